@@ -1,19 +1,63 @@
 import os
+import sys
 import argparse
 
 from . import config
-from .utils import logger, set_log_root
+from .utils import logger, run_stats, set_log_root
 
 
+def add_common_arguments(parser, default=None, package_dest='package'):
+    '''
+    Adds the arguments shared by the scanning, query and merge commands.
+    The subcommands are given default=argparse.SUPPRESS, so that they keep
+    the values given before the command name, and a separate package_dest,
+    so that read_packages combines the --package values of both levels.
+    '''
+    parser.add_argument(
+        "--log",
+        help="set log level",
+        choices=['error', 'warning', 'info', 'debug'],
+        default=default,
+        action="store")
+    parser.add_argument(
+        "--output", '-o',
+        help="Deliver the output to the named file instead of standard output.",
+        default=default,
+        action="store")
+    parser.add_argument(
+        "--package", action="append",
+        dest=package_dest, metavar='PACKAGE',
+        default=default,
+        help="""Limit the list/summary to the given package. The argument can
+simply be the name of a package, or a conda-style package/version spec;
+e.g., 'pandas<0.20'. Multiple --package arguments can be supplied.""")
+    parser.add_argument(
+        "--package-file", action="store",
+        default=default,
+        help="""Read a list of package specs from the given file. One spec
+should be supplied per line. The spec can simply be the name of a package,
+or a conda-style package/version spec; e.g., 'pandas<0.20'.""")
+    parser.add_argument(
+        "--summarize", '-s',
+        help="""Optionally summarize the inventory. Choices include
+project groupings (node, owner, project, environment) and package
+groupings (package, version). You may combine one choice from each
+category as well by separating them with a slash; e.g., owner/package.
+Unsummarized data is equivalent to environment/version.""",
+        default=default,
+        action="store")
+    return parser
+
+
+# Arguments shared by the query and merge commands
+command_parser = add_common_arguments(argparse.ArgumentParser(add_help=False),
+                                      default=argparse.SUPPRESS, package_dest='command_package')
+
 # Arguments for command line
 parser = argparse.ArgumentParser(
     prog="python -m project_inspect",
     description="AE4 project inspection utilities.")
-parser.add_argument(
-    "--log",
-    help="set log level",
-    choices=['error', 'warning', 'info', 'debug'],
-    action="store")
+add_common_arguments(parser)
 parser.add_argument(
     "--owner",
     help="Limit the inventory to a single user.",
@@ -22,39 +66,189 @@ parser.add_argument(
     "--project",
     help="Limit the inventory to a single project. Must be accompanied by --user.",
     action="store")
-parser.add_argument(
-    "--output", '-o',
-    help="Deliver the output to the named file instead of standard output.",
-    action="store")
 parser.add_argument(
     "--root",
     help="Specify the root directory of the project store.",
     action="store")
 parser.add_argument(
-    "--package", action="append",
-    help="""Limit the list/summary to the given package. The argument can
-simply be the name of a package, or a conda-style package/version spec;
-e.g., 'pandas<0.20'. Multiple --package arguments can be supplied.""")
+    "--db",
+    help="""Write the scan results to the named SQLite database, for use with
+the query command. If --output is not also given, no CSV is produced.""",
+    action="store")
 parser.add_argument(
-    "--package-file", action="store",
-    help="""Read a list of package specs from the given file. One spec
-should be supplied per line. The spec can simply be the name of a package,
-or a conda-style package/version spec; e.g., 'pandas<0.20'.""")
+    "--checkpoint",
+    help="""Journal each completed project to the named directory. If the
+scan is interrupted, rerunning it with the same checkpoint directory skips
+the completed projects and produces the same output as an uninterrupted run.""",
+    action="store")
 parser.add_argument(
-    "--summarize", '-s',
-    help="""Optionally summarize the inventory. Choices include
-project groupings (node, owner, project, environment) and package
-groupings (package, version). You may combine one choice from each
-category as well by separating them with a slash; e.g., owner/package.
-Unsummarized data is equivalent to environment/version.""",
+    "--shard",
+    help="""Scan only one shard of the node, given as i/N with 1 <= i <= N.
+The shards are disjoint, and concatenating the unsummarized output of
+shards 1 through N reproduces the output of a full scan, as long as all
+shards are planned from the same weights. Shards run at different times
+should therefore share a --shard-plan.""",
+    action="store")
+parser.add_argument(
+    "--shard-by",
+    help="""The unit of work for --shard: projects, weighted by the size of
+their source files (the default), or owners.""",
+    choices=['project', 'owner'],
+    default='project',
+    action="store")
+parser.add_argument(
+    "--shard-plan",
+    help="""A file holding the units of work and weights used to divide the
+node into shards. If it does not exist, the weights are measured and saved
+there; otherwise they are read from it, so that every shard job sharing the
+file divides the node the same way.""",
+    metavar="FILE",
+    action="store")
+parser.add_argument(
+    "--schedule",
+    help="""The order in which projects are scanned: alphabetical (the
+default), or locality, which scans the projects that use the same
+environments together to improve cache reuse. The output order is the same
+either way.""",
+    choices=['alphabetical', 'locality'],
+    default='alphabetical',
+    action="store")
+parser.add_argument(
+    "--max-parse-size",
+    help="""Files with more than this many characters of source code are
+scanned for imports with a simple line-based scan instead of a full parse.
+Zero disables the limit. Default: {}.""".format(config.MAX_PARSE_SIZE),
+    type=int,
+    action="store")
+parser.add_argument(
+    "--max-parse-time",
+    help="""Abandon the parse of a single file after this many seconds, and
+scan it with a simple line-based scan instead. Zero disables the limit.
+Default: {}.""".format(config.MAX_PARSE_TIME),
+    type=float,
+    action="store")
+parser.add_argument(
+    "--max-read-rate",
+    help="""Limit the rate at which files are read to this many bytes per
+second, averaged over a second, to reduce the impact of the scan on other
+users of the node. Zero disables the limit, which is the default.""",
+    type=float,
+    action="store")
+parser.add_argument(
+    "--max-ops-rate",
+    help="""Limit the number of file reads and directory listings to this
+many per second. Zero disables the limit, which is the default.""",
+    type=float,
+    action="store")
+parser.add_argument(
+    "--nice",
+    help="""Run the scan with a lower CPU priority, and in the idle I/O
+scheduling class where the system supports it, so that interactive users
+are served first.""",
+    action="store_true")
+parser.add_argument(
+    "--progress",
+    help="""Show the progress of the scan on a single status line: the
+projects completed, files parsed per second, environments loaded, cache hit
+rate, and estimated time remaining. Ignored unless standard error is a
+terminal.""",
+    action="store_true")
+parser.add_argument(
+    "--timing-log",
+    help="""Write one JSON line per project scanned to this file, with the
+owner, project, wall time, files scanned, bytes read, time spent parsing
+files and loading environments, number of environments, and number of
+errors. Applies to owner and node scans.""",
+    metavar="FILE",
+    action="store")
+parser.add_argument(
+    "--cache-stats",
+    help="""At the end of the run, print the hits, misses, evictions, size and
+approximate memory use of each internal cache to standard error.""",
+    action="store_true")
+
+subparsers = parser.add_subparsers(dest='command', metavar='command')
+query_parser = subparsers.add_parser(
+    'query', parents=[command_parser],
+    help="Query a database written by a previous scan with --db.",
+    description="Query a database written by a previous scan with --db.")
+query_parser.add_argument(
+    "--db",
+    help="The SQLite database to query.",
+    required=True,
     action="store")
 
+merge_parser = subparsers.add_parser(
+    'merge', parents=[command_parser],
+    help="Merge the inventories of several nodes.",
+    description="""Merge the unsummarized inventories of several nodes into
+one, adding a node column. The files are streamed, so memory use is bounded
+by the size of the summary rather than the number of records.""")
+merge_parser.add_argument(
+    "inventory", nargs='+',
+    help="""An inventory file produced by a scan. The node name is taken
+from the file name, or can be supplied explicitly as NODE=PATH.""")
+
+
+def read_packages(kwargs):
+    packages = (kwargs.get('package') or []) + (kwargs.get('command_package') or [])
+    package_file = kwargs.get('package_file')
+    if package_file:
+        with open(package_file, 'rt') as fp:
+            packages.extend(spec for spec in map(str.strip, fp) if spec)
+    return packages
+
+
+def write_output(df, fname):
+    if fname and fname != '-':
+        df.to_csv(fname, index=None)
+    else:
+        print(df.to_csv(index=None))
+
+
+def write_cache_stats():
+    from .context import current_context
+    row = '{:<20} {:>8} {:>8} {:>10} {:>10} {:>10} {:>9} {:>12}'
+    lines = ['Cache statistics:',
+             row.format('cache', 'entries', 'maxsize', 'hits', 'misses', 'evictions', 'hit rate', 'bytes')]
+    for name, stats in sorted(current_context().stats().items()):
+        lookups = stats['hits'] + stats['misses']
+        rate = '{:.1%}'.format(stats['hits'] / lookups) if lookups else '-'
+        lines.append(row.format(name, stats['entries'], stats['maxsize'] or '-', stats['hits'],
+                                stats['misses'], stats['evictions'], rate, stats['bytes']))
+    print('\n'.join(lines), file=sys.stderr)
+
+
+def query(**kwargs):
+    from .database import InventoryDatabase
+    if not os.path.exists(kwargs['db']):
+        raise RuntimeError('Database not found: {}'.format(kwargs['db']))
+    with InventoryDatabase(kwargs['db']) as database:
+        df = database.query(read_packages(kwargs), kwargs.get('summarize'))
+    write_output(df, kwargs.get('output'))
+    return 0
+
+
+def merge(**kwargs):
+    from .merge import merge_inventories, summarize_records, write_records
+    records = merge_inventories(kwargs['inventory'], read_packages(kwargs))
+    summary = kwargs.get('summarize')
+    if summary:
+        write_output(summarize_records(records, summary), kwargs.get('output'))
+    else:
+        write_records(records, kwargs.get('output'))
+    return 0
+
 
 def main(**kwargs):
     loglev = (kwargs.get('log') or 'warning').upper()
     import logging
     logging.basicConfig(format='%(message)s')
     logger.setLevel(getattr(logging, loglev))
+    if kwargs.get('command') == 'query':
+        return query(**kwargs)
+    elif kwargs.get('command') == 'merge':
+        return merge(**kwargs)
     root = kwargs.get('root')
     if root:
         root = os.path.abspath(root)
@@ -62,33 +256,99 @@ def main(**kwargs):
     else:
         root = config.PROJECT_ROOT
     logger.info('Project root: {}'.format(root))
+    if kwargs.get('max_parse_size') is not None:
+        config.MAX_PARSE_SIZE = kwargs['max_parse_size']
+    if kwargs.get('max_parse_time') is not None:
+        config.MAX_PARSE_TIME = kwargs['max_parse_time']
+    if kwargs.get('max_read_rate') is not None:
+        config.MAX_READ_RATE = kwargs['max_read_rate']
+    if kwargs.get('max_ops_rate') is not None:
+        config.MAX_OPS_RATE = kwargs['max_ops_rate']
+    if kwargs.get('nice'):
+        from .throttle import lower_priority
+        if not lower_priority():
+            logger.warning('Could not lower the I/O priority; only the CPU priority was lowered')
     from . import project
+    database = None
+    if kwargs.get('db'):
+        from .database import InventoryDatabase
+        database = InventoryDatabase(kwargs['db'])
+    checkpoint = None
+    if kwargs.get('checkpoint'):
+        from .checkpoint import Checkpoint
+        checkpoint = Checkpoint(kwargs['checkpoint'], root)
+    # A scan that only writes to the database never needs a DataFrame
+    records_only = database is not None and not kwargs.get('output')
     uname = kwargs.get('owner')
     pname = kwargs.get('project')
+    shard = kwargs.get('shard')
+    projects = None
+    if shard:
+        if uname:
+            raise RuntimeError('Cannot combine --shard with --owner')
+        # The shard is selected once, for both the scan and the progress meter
+        projects = project.select_shard(root, *project.parse_shard(shard),
+                                        by=kwargs.get('shard_by') or 'project',
+                                        plan=kwargs.get('shard_plan'))
+    elif kwargs.get('shard_plan'):
+        raise RuntimeError('Must supply --shard with --shard-plan')
+    if pname and not uname:
+        raise RuntimeError('Must supply --owner with --project')
+    progress = None
+    if kwargs.get('progress') and not pname and sys.stderr.isatty():
+        from .progress import ProgressMeter
+        if projects is not None:
+            total = len(projects)
+        else:
+            total = project.count_projects(root, uname)
+        progress = ProgressMeter(total)
+    callbacks = [progress.update] if progress is not None else []
+    timing_log = None
+    if kwargs.get('timing_log') and not pname:
+        from .progress import TimingLog
+        timing_log = TimingLog(kwargs['timing_log'])
+        callbacks.append(timing_log.update)
+
+    def on_result(result):
+        for callback in callbacks:
+            callback(result)
     if uname:
         if pname:
-            df = project.build_project_inventory(uname, pname, root)
+            df = project.build_project_inventory(uname, pname, root, records_only=records_only,
+                                                 database=database)
         else:
-            df = project.build_owner_inventory(uname, root)
-    elif pname:
-        raise RuntimeError('Must supply --owner with --project')
+            df = project.build_owner_inventory(uname, root, records_only=records_only,
+                                               database=database, checkpoint=checkpoint,
+                                               progress=on_result if callbacks else None)
     else:
-        df = project.build_node_inventory(root)
-    packages = kwargs.get('package') or []
-    package_file = kwargs.get('package_file')
-    if package_file:
-        with open(package_file, 'rt') as fp:
-            packages.extend(spec for spec in map(str.strip, fp) if spec)
-    if packages:
-        df = project.filter_data(df, packages)
-    summary = kwargs.get('summarize')
-    if summary:
-        df = project.summarize_data(df, summary)
-    fname = kwargs.get('output')
-    if fname and fname != '-':
-        df.to_csv(fname, index=None)
-    else:
-        print(df.to_csv(index=None))
+        df = project.build_node_inventory(root, records_only=records_only, database=database,
+                                          checkpoint=checkpoint, projects=projects,
+                                          schedule=kwargs.get('schedule') or 'alphabetical',
+                                          progress=on_result if callbacks else None)
+    if progress is not None:
+        progress.close()
+    if timing_log is not None:
+        timing_log.close()
+    from .throttle import throttled_time
+    if throttled_time():
+        run_stats['throttled_seconds'] = round(throttled_time())
+    if run_stats:
+        logger.info('Run statistics: {}'.format(', '.join('{}={}'.format(k, v)
+                                                          for k, v in sorted(run_stats.items()))))
+    if checkpoint is not None:
+        checkpoint.close()
+    if database is not None:
+        database.close()
+    if database is None or kwargs.get('output'):
+        packages = read_packages(kwargs)
+        if packages:
+            df = project.filter_data(df, packages)
+        summary = kwargs.get('summarize')
+        if summary:
+            df = project.summarize_data(df, summary)
+        write_output(df, kwargs.get('output'))
+    if kwargs.get('cache_stats'):
+        write_cache_stats()
     return 0
 
 
@@ -0,0 +1,111 @@
+import sys
+
+from collections import OrderedDict
+
+__all__ = ['LRUCache', 'approximate_size']
+
+
+def approximate_size(obj):
+    '''
+    Estimates the memory used by an object and everything it refers to,
+    through containers and slots. Objects shared within the structure are
+    counted once.
+    '''
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    if hasattr(obj, slot):
+                        stack.append(getattr(obj, slot))
+    return total
+
+
+class LRUCache(object):
+    '''
+    A dictionary-like cache holding at most maxsize entries. When it is
+    full, adding an entry evicts the least recently used one. Lookups and
+    evictions are counted for stats().
+
+    Args:
+        maxsize (int): the maximum number of entries. None means unbounded.
+    '''
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __getitem__(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        data = self._data
+        data[key] = value
+        data.move_to_end(key)
+        if self.maxsize is not None and len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._data)
+
+    def items(self):
+        '''
+        Returns the entries, without counting lookups or refreshing them.
+        '''
+        return list(self._data.items())
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self, size=True):
+        '''
+        Returns the lookup counts and the current size of the cache.
+
+        Args:
+            size (bool): if True, include the approximate memory used by the
+                entries, which requires walking all of them.
+        Returns:
+            dict: the hits, misses, evictions, entries, and maxsize, and
+                optionally the bytes.
+        '''
+        result = {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                  'entries': len(self._data), 'maxsize': self.maxsize}
+        if size:
+            result['bytes'] = approximate_size(self._data)
+        return result
@@ -0,0 +1,117 @@
+import json
+import os
+
+from os.path import abspath, basename, dirname, join
+
+from .utils import logger
+
+__all__ = ['Checkpoint']
+
+
+class Checkpoint(object):
+    '''
+    An append-only journal of completed projects, allowing an interrupted
+    scan to resume where it left off. The records of each project are
+    written as one line, along with the environment data a database needs
+    to store them, followed by a completion marker; a project only
+    counts as complete once its marker has been written and synced. A
+    partially written tail left by a crash is discarded on reopening.
+
+    Args:
+        directory (str): the checkpoint directory; created if missing.
+        project_root (str): the root of the project store being scanned.
+            A journal written for a different root is rejected.
+    '''
+
+    def __init__(self, directory, project_root):
+        os.makedirs(directory, exist_ok=True)
+        self.path = join(directory, 'journal.jsonl')
+        self.project_root = abspath(project_root)
+        self.completed = {}
+        self.environments = {}
+        has_root = os.path.exists(self.path) and self._load()
+        self._fp = open(self.path, 'at')
+        if not has_root:
+            self._write({'root': self.project_root})
+        logger.info('Checkpoint: {} completed projects in {}'.format(len(self.completed), self.path))
+
+    def _load(self):
+        with open(self.path, 'rb') as fp:
+            data = fp.read()
+        lines = data.split(b'\n')
+        if lines[-1]:
+            # Discard a partial line, so that new entries start cleanly
+            with open(self.path, 'r+b') as fp:
+                fp.truncate(len(data) - len(lines[-1]))
+        pending = {}
+        has_root = False
+        for line in lines[:-1]:
+            entry = json.loads(line.decode('utf-8'))
+            if 'root' in entry:
+                if entry['root'] != self.project_root:
+                    raise RuntimeError('Checkpoint {} was written for a different root: {}'
+                                       .format(self.path, entry['root']))
+                has_root = True
+            elif 'done' in entry:
+                key = entry['done']
+                self.completed[key], environments = pending.pop(key, ([], None))
+                if environments is not None:
+                    self.environments[key] = environments
+            else:
+                pending[entry['project']] = ([tuple(r) for r in entry['records']],
+                                             entry.get('environments'))
+        return has_root
+
+    def _write(self, entry, sync=False):
+        self._fp.write(json.dumps(entry) + '\n')
+        if sync:
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+
+    @staticmethod
+    def key(project_home):
+        project_home = abspath(project_home)
+        return '{}/{}'.format(basename(dirname(project_home)), basename(project_home))
+
+    def get(self, project_home):
+        '''
+        Returns the journaled records of a completed project, or None if
+        the project has not been completed.
+        '''
+        return self.completed.get(self.key(project_home))
+
+    def get_environments(self, project_home):
+        '''
+        Returns the journaled environment data of a completed project, in
+        the format of find_project_imports, or None if it was not recorded.
+        '''
+        return self.environments.get(self.key(project_home))
+
+    def add(self, project_home, records, environments=None):
+        '''
+        Journals the records of a completed project. If given, the
+        environment data from find_project_imports is journaled as well, so
+        that a resumed scan can store the project in a database.
+        '''
+        key = self.key(project_home)
+        entry = {'project': key, 'records': records}
+        if environments is not None:
+            environments = {prefix: {'shortname': envrec['shortname'],
+                                     'files': {fpath: [language, sorted(requests), sorted(missing)]
+                                               for fpath, (language, requests, missing)
+                                               in envrec['files'].items()}}
+                            for prefix, envrec in environments.items()}
+            entry['environments'] = environments
+            self.environments[key] = environments
+        self._write(entry)
+        self._write({'done': key}, sync=True)
+        self.completed[key] = records
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
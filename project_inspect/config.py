@@ -1,2 +1,14 @@
 WAKARI_ROOT = '/opt/wakari'
 PROJECT_ROOT = '/projects'
+
+# Limits on the parsing of a single file. Files whose source code exceeds
+# MAX_PARSE_SIZE characters, or whose parse takes longer than MAX_PARSE_TIME
+# seconds, fall back to a linear-time import scan. Zero disables a limit.
+MAX_PARSE_SIZE = 1 << 20
+MAX_PARSE_TIME = 10.0
+
+# Limits on the I/O of a scan, enforced by throttle.throttle: the bytes read
+# per second, and the file reads and directory listings per second. Zero
+# disables a limit.
+MAX_READ_RATE = 0
+MAX_OPS_RATE = 0
@@ -0,0 +1,139 @@
+import functools
+
+from .cache import LRUCache
+
+__all__ = ['InventoryContext', 'current_context']
+
+
+# The default number of entries retained by each cache
+CACHE_SIZES = {
+    'notebooks': 4096,            # imports.analyze_notebook
+    'contents': 65536,            # imports.analyze_content
+    'importables': 1024,          # environments.get_python_importables
+    'local_packages': 1024,       # environments.get_local_packages
+    'environments': 1024,         # environments.environment_by_prefix
+    'environment_imports': 1024,  # environments.environment_imports
+    'eggs': 16384,                # environments.get_eggs, per entry
+    'conda_packages': 65536,      # environments.conda_package_record
+    'versions': 4096,             # version.VersionOrder
+    'version_specs': 4096,        # version.VersionSpec
+    'markers': 1024,              # distributions.marker_applies
+}
+# The caches keyed by file or directory paths, which evict_local searches
+PATH_CACHES = ('notebooks', 'importables', 'local_packages',
+               'environments', 'environment_imports', 'eggs')
+# The caches whose entries are shared by several files, and record those
+# files in a 'paths' member; evict_local removes the paths instead
+SHARED_CACHES = ('conda_packages',)
+
+
+class InventoryContext(object):
+    '''
+    Owns the caches used by a scan. One context is current at any time;
+    a new context is made current with a with statement, and the previous
+    one is restored on exit:
+
+        with InventoryContext(environments=4096) as context:
+            df = build_node_inventory(root)
+
+    Args:
+        sizes: the maximum number of entries of individual caches, by the
+            names in CACHE_SIZES. None means unbounded.
+    '''
+
+    def __init__(self, **sizes):
+        unknown = set(sizes) - set(CACHE_SIZES)
+        if unknown:
+            raise RuntimeError('Unknown caches: {}'.format(', '.join(sorted(unknown))))
+        self.caches = {name: LRUCache(sizes.get(name, size)) for name, size in CACHE_SIZES.items()}
+        self._previous = []
+
+    def cache(self, name):
+        return self.caches[name]
+
+    def clear(self):
+        '''
+        Empties every cache, so that the next scan rereads everything.
+        '''
+        for cache in self.caches.values():
+            cache.clear()
+
+    def stats(self, size=True):
+        '''
+        Returns the statistics of every cache, as given by LRUCache.stats,
+        keyed by the cache name.
+        '''
+        return {name: cache.stats(size) for name, cache in self.caches.items()}
+
+    def evict_local(self, path):
+        '''
+        Removes the entries of every cache whose arguments include the given
+        directory or a path within it. This is done once the projects of an
+        owner are complete, since nothing else on the node refers to them.
+        Shared entries forget the paths within the directory, and are only
+        removed once no other path uses them.
+
+        Args:
+            path (str): the directory whose entries are evicted.
+        Returns:
+            int: the number of entries removed.
+        '''
+        path = path.rstrip('/')
+        prefix = path + '/'
+        count = 0
+        for name in PATH_CACHES:
+            cache = self.caches[name]
+            for key in cache.keys():
+                args = key if isinstance(key, tuple) else (key,)
+                if any(isinstance(arg, str) and (arg == path or arg.startswith(prefix)) for arg in args):
+                    del cache[key]
+                    count += 1
+        for name in SHARED_CACHES:
+            cache = self.caches[name]
+            for key, entry in cache.items():
+                paths = entry['paths']
+                paths.difference_update([fpath for fpath in paths if fpath.startswith(prefix)])
+                if not paths:
+                    del cache[key]
+                    count += 1
+        return count
+
+    def __enter__(self):
+        global _current
+        self._previous.append(_current)
+        _current = self
+        return self
+
+    def __exit__(self, *args):
+        global _current
+        _current = self._previous.pop()
+
+
+_current = InventoryContext()
+
+
+def current_context():
+    return _current
+
+
+_KWARGS = object()
+
+
+def cached(name):
+    '''
+    Memoizes a function in the named cache of the current context, in the
+    manner of functools.lru_cache. The arguments must be hashable.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = args + (_KWARGS,) + tuple(sorted(kwargs.items())) if kwargs else args
+            cache = _current.caches[name]
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+            result = cache[key] = func(*args, **kwargs)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,229 @@
+import sqlite3
+
+from .environments import environment_by_prefix
+from .project import _build_df, parse_package_spec, summary_grouping, SUMMARY_COLUMNS
+from .utils import logger
+from .version import VersionSpec
+
+__all__ = ['InventoryDatabase']
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS owners (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    owner_id INTEGER NOT NULL REFERENCES owners(id),
+    name TEXT NOT NULL,
+    UNIQUE (owner_id, name)
+);
+CREATE TABLE IF NOT EXISTS environments (
+    id INTEGER PRIMARY KEY,
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    prefix TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    package_id INTEGER NOT NULL REFERENCES packages(id),
+    version TEXT NOT NULL,
+    build TEXT NOT NULL,
+    UNIQUE (package_id, version, build)
+);
+CREATE TABLE IF NOT EXISTS contents (
+    environment_id INTEGER NOT NULL REFERENCES environments(id) ON DELETE CASCADE,
+    version_id INTEGER NOT NULL REFERENCES versions(id),
+    required INTEGER NOT NULL,
+    requested INTEGER NOT NULL,
+    required_by TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dependencies (
+    environment_id INTEGER NOT NULL REFERENCES environments(id) ON DELETE CASCADE,
+    package_id INTEGER NOT NULL REFERENCES packages(id),
+    depends_id INTEGER NOT NULL REFERENCES packages(id)
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    environment_id INTEGER NOT NULL REFERENCES environments(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    language TEXT
+);
+CREATE TABLE IF NOT EXISTS imports (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS environments_project ON environments(project_id);
+CREATE INDEX IF NOT EXISTS versions_package ON versions(package_id);
+CREATE INDEX IF NOT EXISTS contents_environment ON contents(environment_id);
+CREATE INDEX IF NOT EXISTS contents_version ON contents(version_id);
+CREATE INDEX IF NOT EXISTS dependencies_package ON dependencies(environment_id, package_id);
+CREATE INDEX IF NOT EXISTS dependencies_depends ON dependencies(depends_id);
+CREATE INDEX IF NOT EXISTS files_environment ON files(environment_id);
+CREATE INDEX IF NOT EXISTS imports_file ON imports(file_id);
+CREATE INDEX IF NOT EXISTS imports_name ON imports(name, kind);
+'''
+
+INVENTORY_QUERY = '''
+SELECT o.name, pr.name, e.name, p.name, v.version, v.build,
+       c.required, c.requested, c.required_by
+FROM contents c
+JOIN environments e ON e.id = c.environment_id
+JOIN projects pr ON pr.id = e.project_id
+JOIN owners o ON o.id = pr.owner_id
+JOIN versions v ON v.id = c.version_id
+JOIN packages p ON p.id = v.package_id
+'''
+
+GROUP_EXPRESSIONS = {'owner': 'o.name', 'project': 'pr.name', 'environment': 'e.name',
+                     'package': 'p.name', 'version': 'v.version'}
+
+SUMMARY_EXPRESSIONS = ('COUNT(DISTINCT o.id)', 'COUNT(DISTINCT pr.id)', 'COUNT(DISTINCT e.id)',
+                       'COALESCE(SUM(c.required), 0)', 'COALESCE(SUM(c.requested), 0)',
+                       "COALESCE(SUM(p.name = 'python'), 0)", "COALESCE(SUM(p.name = 'r-base'), 0)")
+
+
+class InventoryDatabase(object):
+    '''
+    A normalized SQLite store for inventory results. Scans write into it
+    through the database argument of the build_*_inventory functions, and
+    query() answers --package/--summarize requests without rescanning.
+
+    Args:
+        path (str): the path to the SQLite database; created if missing.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(SCHEMA)
+        self._ids = {}
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _lookup(self, table, **values):
+        key = (table,) + tuple(sorted(values.items()))
+        result = self._ids.get(key)
+        if result is None:
+            names = sorted(values)
+            where = ' AND '.join('{} = ?'.format(n) for n in names)
+            params = [values[n] for n in names]
+            row = self.conn.execute('SELECT id FROM {} WHERE {}'.format(table, where), params).fetchone()
+            if row is None:
+                sql = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(names), ', '.join('?' * len(names)))
+                row = (self.conn.execute(sql, params).lastrowid,)
+            result = self._ids[key] = row[0]
+        return result
+
+    def add_project(self, owner_name, project_name, all_envs, records):
+        '''
+        Stores the results of a single project scan, replacing any
+        previously stored results for the same project.
+
+        Args:
+            owner_name (str): the owner of the project.
+            project_name (str): the name of the project.
+            all_envs (dict): the environment records from find_project_imports.
+            records (list): the inventory records for the project.
+        '''
+        conn = self.conn
+        owner_id = self._lookup('owners', name=owner_name)
+        conn.execute('DELETE FROM projects WHERE owner_id = ? AND name = ?', (owner_id, project_name))
+        project_id = conn.execute('INSERT INTO projects (owner_id, name) VALUES (?, ?)',
+                                  (owner_id, project_name)).lastrowid
+        env_ids = {}
+        for prefix, envrec in all_envs.items():
+            env_id = env_ids[envrec['shortname']] = conn.execute(
+                'INSERT INTO environments (project_id, name, prefix) VALUES (?, ?, ?)',
+                (project_id, envrec['shortname'], prefix)).lastrowid
+            for fpath, (language, requests, missing) in sorted(envrec['files'].items()):
+                file_id = conn.execute('INSERT INTO files (environment_id, path, language) VALUES (?, ?, ?)',
+                                       (env_id, fpath, language)).lastrowid
+                rows = [(file_id, 'local', pkg[2:]) if pkg.startswith('./') else (file_id, 'package', pkg)
+                        for pkg in sorted(requests)]
+                rows.extend((file_id, 'missing', module) for module in sorted(missing))
+                conn.executemany('INSERT INTO imports (file_id, kind, name) VALUES (?, ?, ?)', rows)
+        contents = []
+        installed = {}
+        for _, _, envname, pkg, version, build, required, requested, required_by in records:
+            package_id = self._lookup('packages', name=pkg)
+            version_id = self._lookup('versions', package_id=package_id, version=version, build=build)
+            contents.append((env_ids[envname], version_id, required, requested, required_by))
+            installed.setdefault(envname, set()).add(pkg)
+        conn.executemany('INSERT INTO contents (environment_id, version_id, required, requested, required_by) '
+                         'VALUES (?, ?, ?, ?, ?)', contents)
+        edges = []
+        for prefix, envrec in all_envs.items():
+            names = installed.get(envrec['shortname'])
+            if not names:
+                continue
+            env_id = env_ids[envrec['shortname']]
+            packages = environment_by_prefix(prefix)['packages']
+            for pkg in sorted(names):
+                package_id = self._lookup('packages', name=pkg)
+                for dep in sorted(packages.get(pkg, {}).get('depends', set()) & names):
+                    edges.append((env_id, package_id, self._lookup('packages', name=dep)))
+        conn.executemany('INSERT INTO dependencies (environment_id, package_id, depends_id) '
+                         'VALUES (?, ?, ?)', edges)
+        conn.commit()
+        logger.debug('{}/{}: stored in {}'.format(owner_name, project_name, self.path))
+
+    def _package_filter(self, packages):
+        clauses, params = [], []
+        for package in packages:
+            name, version = parse_package_spec(package)
+            if version:
+                vspec = VersionSpec(version)
+                rows = self.conn.execute('SELECT v.id, v.version FROM versions v '
+                                         'JOIN packages p ON p.id = v.package_id '
+                                         'WHERE p.name = ?', (name,))
+                version_ids = [vid for vid, vstr in rows if vspec.match(vstr)]
+                clauses.append('v.id IN ({})'.format(', '.join('?' * len(version_ids)) or 'NULL'))
+                params.extend(version_ids)
+            else:
+                clauses.append('p.name = ?')
+                params.append(name)
+        return ' OR '.join(clauses), params
+
+    def query(self, packages=None, summarize=None):
+        '''
+        Retrieves the stored inventory, optionally filtered and summarized.
+        The results are identical to applying filter_data and summarize_data
+        to the output of the original scan.
+
+        Args:
+            packages (list): package specs, as accepted by filter_data.
+            summarize (str): a summary level, as accepted by summarize_data.
+        Returns:
+            DataFrame: the inventory or its summary.
+        '''
+        where, params = self._package_filter(packages) if packages else ('', [])
+        where = ' WHERE ' + where if where else ''
+        if not summarize:
+            sql = INVENTORY_QUERY + where + ' ORDER BY c.rowid'
+            records = self.conn.execute(sql, params).fetchall()
+            return _build_df(records)
+        grouping, left, right = summary_grouping(summarize)
+        columns = [GROUP_EXPRESSIONS[g] for g in grouping]
+        sql = 'SELECT {}'.format(', '.join(columns + list(SUMMARY_EXPRESSIONS[left:right])))
+        sql += INVENTORY_QUERY[INVENTORY_QUERY.index('\nFROM'):] + where
+        if columns:
+            sql += ' GROUP BY {0} ORDER BY {0}'.format(', '.join(columns))
+        records = self.conn.execute(sql, params).fetchall()
+        import pandas as pd
+        return pd.DataFrame(records, columns=grouping + list(SUMMARY_COLUMNS[left:right]))
@@ -0,0 +1,240 @@
+import os
+import re
+import zipfile
+
+from os.path import basename, dirname, isdir, join, splitext
+
+from .context import cached
+from .throttle import throttle
+from .utils import warn_file
+
+__all__ = ['read_distribution']
+
+
+# The file name conventions of setuptools: NAME-VERSION-pyPYVER-PLATFORM
+EGG_NAME = re.compile(r'(?P<name>[^-]+)(?:-(?P<ver>[^-]+)(?:-py(?P<pyver>[^-]+)(?:-(?P<plat>.+))?)?)?', re.I)
+SAFE_NAME = re.compile(r'[^A-Za-z0-9.]+')
+REQUIREMENT_NAME = re.compile(r'\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+# The only metadata files consulted; everything else is never opened
+METADATA_FILES = ('METADATA', 'PKG-INFO', 'RECORD', 'SOURCES.txt',
+                  'top_level.txt', 'requires.txt', 'depends.txt')
+
+
+def safe_name(name):
+    return SAFE_NAME.sub('-', name)
+
+
+def safe_version(version):
+    '''
+    Normalizes a version string the way setuptools does: a valid PEP 440
+    version is put in canonical form, and anything else has its runs of
+    unusual characters replaced by dashes.
+    '''
+    try:
+        from packaging.version import Version
+        return str(Version(version))
+    except Exception:
+        return SAFE_NAME.sub('-', version.replace(' ', '.'))
+
+
+@cached('markers')
+def marker_applies(marker):
+    '''
+    Evaluates an environment marker for the running interpreter, with no
+    extras selected. Without the packaging library, only the markers that
+    mention extras are rejected.
+    '''
+    try:
+        from packaging.markers import Marker
+    except ImportError:
+        return 'extra' not in marker
+    try:
+        return Marker(marker).evaluate({'extra': ''})
+    except Exception:
+        return False
+
+
+def _read_text(fp):
+    data = fp.read()
+    throttle(len(data))
+    return data.decode('utf-8', errors='replace')
+
+
+def _read_directory(path, names):
+    files = {}
+    for name in set(names).intersection(METADATA_FILES):
+        with open(join(path, name), 'rb') as fp:
+            files[name] = _read_text(fp)
+    return files
+
+
+def _read_zip(path):
+    files = {}
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+        for name in METADATA_FILES:
+            if 'EGG-INFO/' + name in names:
+                with zf.open('EGG-INFO/' + name) as fp:
+                    files[name] = _read_text(fp)
+    return files
+
+
+def _find_metadata(path, links=True):
+    '''
+    Yields the base name and the metadata files of each distribution found
+    at a site-packages entry. A development link is followed to the source
+    directory it names, which is searched for metadata in turn.
+    '''
+    fn = basename(path)
+    lower = fn.lower()
+    if lower.endswith(('.egg-info', '.dist-info')):
+        if isdir(path):
+            names = os.listdir(path)
+            if names:
+                yield fn, _read_directory(path, names)
+        elif lower.endswith('.egg-info'):
+            with open(path, 'rb') as fp:
+                yield fn, {'PKG-INFO': _read_text(fp)}
+    elif lower.endswith('.egg'):
+        if isdir(path):
+            path = join(path, 'EGG-INFO')
+            if isdir(path):
+                yield fn, _read_directory(path, os.listdir(path))
+        elif zipfile.is_zipfile(path):
+            files = _read_zip(path)
+            if 'PKG-INFO' in files:
+                yield fn, files
+    elif links and lower.endswith('.egg-link'):
+        with open(path, 'rt', errors='replace') as fp:
+            target = next((line.strip() for line in fp if line.strip()), None)
+        if target is not None:
+            target = join(dirname(path), target)
+            children = os.listdir(target) if isdir(target) else ()
+            for child in sorted(children):
+                yield from _find_metadata(join(target, child), links=False)
+
+
+def _parse_headers(text):
+    '''
+    Parses the header block of a PKG-INFO/METADATA file, stopping at the
+    blank line before the description.
+    '''
+    headers = {}
+    for line in text.splitlines():
+        if not line:
+            break
+        if line[0] in ' \t' or ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        headers.setdefault(key.strip().lower(), []).append(value.strip())
+    return headers
+
+
+def _dist_info_requires(headers):
+    for req in headers.get('requires-dist', ()):
+        req, _, marker = req.partition(';')
+        if marker.strip() and not marker_applies(marker.strip()):
+            continue
+        match = REQUIREMENT_NAME.match(req)
+        if match:
+            yield match.group(1)
+
+
+def _egg_info_requires(text):
+    '''
+    Yields the unconditional requirements of a requires.txt file, along with
+    those of the sections whose marker applies. Sections for extras are
+    skipped.
+    '''
+    extra, marker = '', ''
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            extra, _, marker = line[1:-1].partition(':')
+            continue
+        if extra.strip() or marker.strip() and not marker_applies(marker.strip()):
+            continue
+        match = REQUIREMENT_NAME.match(line)
+        if match:
+            yield match.group(1)
+
+
+def _source_modules(sources):
+    modules = set()
+    for src in sources.splitlines():
+        src = src.strip().split(',', 1)[0]
+        if src.endswith('__init__.py'):
+            src = dirname(src)
+        elif src.endswith(('.py', '.so')):
+            src = src[:-3]
+        else:
+            continue
+        modules.add(src.replace('/', '.'))
+    return modules
+
+
+def _add_metadata(pdata, fn, files):
+    base, ext = splitext(fn)
+    ext = ext.lower()
+    match = EGG_NAME.match(base)
+    name, version = match.group('name', 'ver') if match else (None, None)
+    version = safe_version(version) if version else None
+    headers = _parse_headers(files.get('METADATA' if ext == '.dist-info' else 'PKG-INFO', ''))
+    # Egg-info metadata takes precedence over the file name
+    if ext == '.egg-info' or not version:
+        md_version = safe_version(headers.get('version', [''])[0])
+        version = md_version or version
+    if pdata['name'] is None:
+        pdata['name'] = safe_name(name or 'Unknown')
+        pdata['version'] = version or '<dev>'
+    if ext == '.dist-info':
+        pdata['depends'].update(_dist_info_requires(headers))
+    else:
+        for requires in ('requires.txt', 'depends.txt'):
+            pdata['depends'].update(_egg_info_requires(files.get(requires, '')))
+    sources = files.get('RECORD', files.get('SOURCES.txt'))
+    top_level = files.get('top_level.txt')
+    if sources is not None and top_level is not None and top_level.splitlines():
+        pdata['modules']['python'].update(_source_modules(sources))
+
+
+def read_distribution(path):
+    '''
+    Reads the package data of a non-conda distribution from its metadata.
+    Only the few metadata files needed are opened, each exactly once:
+    METADATA/PKG-INFO for the version and dependencies, RECORD/SOURCES.txt
+    and top_level.txt for the modules, and requires.txt for the egg-info
+    dependencies. The results follow the conventions of pkg_resources.
+
+    Args:
+        path (str): an .egg-info, .dist-info, .egg, or .egg-link entry.
+    Returns:
+        dict: the package data, in the format of parse_conda_meta.
+    '''
+    fn = basename(path)
+    pdata = {'name': None,
+             'version': None,
+             'build': '<pip>',
+             'depends': set(),
+             'modules': {'python': set(), 'r': set()}}
+    try:
+        dists = list(_find_metadata(path))
+    except Exception as e:
+        warn_file(path, 'ERROR READING EGGS', e, error=True)
+        dists = []
+    for dist_fn, files in dists:
+        try:
+            _add_metadata(pdata, dist_fn, files)
+        except Exception as e:
+            warn_file(fn, 'UNEXPECTED ERROR', e, error=True)
+    if not pdata['name']:
+        base = fn.rsplit('.', 1)[0]
+        name, version = base, '<dev>'
+        if fn.endswith(('.dist-info', '.egg-info')):
+            match = EGG_NAME.match(base)
+            if match:
+                name, version = match.group('name'), match.group('ver') or version
+        pdata['name'], pdata['version'] = name, version
+    return pdata
@@ -1,4 +1,4 @@
-import functools
+import hashlib
 import subprocess
 import sys
 import json
@@ -9,16 +9,21 @@ from os.path import basename, dirname, join, exists, isfile, isdir
 from glob import glob
 
 from . import config
+from .context import cached, current_context
+from .distributions import read_distribution
 from .imports import find_file_imports
-from .utils import load_file, warn_file
+from .throttle import throttle
+from .utils import read_file, timed
 
 import logging
-import pkg_resources
 logger = logging.getLogger(__name__)
 
 __all__ = ['environment_by_prefix', 'kernel_name_to_prefix']
 
 
+EGG_EXTENSIONS = ('.egg-info', '.dist-info', '.egg', '.egg-link')
+
+
 def get_python_builtins(pybin):
     '''
     Determines the python modules that have been compiled into the Python executable.
@@ -61,26 +66,59 @@ def get_python_path(prefix):
     return results
 
 
+EGG_MATCH = re.compile(r'^lib/python\d.\d/(?:site-packages/|lib-dynload/|)'
+                       r'([^/\n]*[.](?:egg-info|dist-info|egg))', re.M)
+
+
+# The members of a conda-meta record read by parse_conda_meta
+CONDA_HEADER = ('name', 'version', 'build', 'depends')
+
+
 def parse_conda_meta(mpath):
-    mdata = load_file(mpath) or {}
+    '''
+    Reads the header of a conda-meta record: the name, version, build, and
+    dependencies of the package. The rest of the record, including the long
+    file lists, is skipped without being decoded; the files are only read
+    by conda_package_eggs and parse_conda_modules.
+
+    Args:
+        mpath (str): path to the conda-meta JSON record.
+    Returns:
+        dict: the package header.
+    '''
+    mdata = read_file(mpath, members=CONDA_HEADER) or {}
     fname, fversion, fbuild = basename(mpath).rsplit('.', 1)[0].rsplit('-', 2)
     pdata = {'name': mdata.get('name', fname),
              'version': mdata.get('version', fversion),
              'build': mdata.get('build', fbuild),
              'depends': set(d.split(' ', 1)[0] for d in mdata.get('depends', ())),
-             'modules': {'python': set(), 'r': set()},
-             'eggs': set(),
+             'meta': mpath,
              'readable': bool(mdata)}
-    py_modules = pdata['modules']['python']
-    r_modules = pdata['modules']['r']
-    for fpath in mdata.get('files', ()):
+    return pdata
+
+
+def parse_conda_modules(files):
+    '''
+    Builds the module index of a conda package from the file list of its
+    conda-meta record. The modules compiled into a Python executable depend
+    on the environment, so they are added by environment_imports instead.
+
+    Args:
+        files (list): the paths installed by the package, relative to the prefix.
+    Returns:
+        dict: the sets of Python and R modules provided by the package,
+            keyed by language.
+    '''
+    modules = {'python': set(), 'r': set()}
+    py_modules = modules['python']
+    r_modules = modules['r']
+    for fpath in files:
         m1 = re.match(r'^lib/python\d.\d/(?:site-packages/|lib-dynload/|)(.*)$', fpath)
         if m1:
             stub = m1.groups()[0]
             m2 = re.match(r'^([^/]*[.](?:egg-info|dist-info|egg))/?(.*)', stub)
             if m2:
                 eggname, stub = m2.groups()
-                pdata['eggs'].add(eggname)
                 if not eggname.endswith('.egg') or not stub:
                     continue
             if stub.endswith('__init__.py'):
@@ -96,71 +134,96 @@ def parse_conda_meta(mpath):
         if m1:
             stub = m1.groups()[0]
             r_modules.add(stub)
-        if fpath == 'bin/python':
-            prefix = dirname(dirname(mpath))
-            py_modules.update(get_python_builtins(join(prefix, fpath)))
-    return pdata
+    return modules
+
+
+def conda_package_record(pdata, modules=False):
+    '''
+    Returns the data of a conda package that is shared by every environment
+    holding it. Each environment has its own conda-meta record, which also
+    describes how the package was linked there, so the data is shared by the
+    name, version and build of the package, and checked against a hash of
+    its file list. Only the file list of the record is decoded.
+
+    Args:
+        pdata (dict): the package header, as given by parse_conda_meta.
+        modules (bool): if True, the module data is built if it is missing.
+    Returns:
+        dict: the names of the egg/dist-info entries the package installs,
+            its module data, if built, whether it installs bin/python, and
+            the paths that share the record, which evict_local prunes.
+    '''
+    mpath = pdata['meta']
+    mdata = read_file(mpath, members=('files',))
+    if mdata is None:
+        return {'eggs': set(), 'modules': {'python': set(), 'r': set()}, 'python': False,
+                'paths': set()}
+    files = mdata.get('files', [])
+    text = '\n'.join(files)
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    key = (pdata['name'], pdata['version'], pdata['build'], digest)
+    cache = current_context().cache('conda_packages')
+    entry = cache.get(key)
+    if entry is None:
+        entry = cache[key] = {'eggs': set(EGG_MATCH.findall(text)), 'modules': None,
+                              'python': 'bin/python' in files, 'paths': set()}
+    if modules and entry['modules'] is None:
+        entry['modules'] = parse_conda_modules(files)
+    entry['paths'].add(mpath)
+    return entry
+
+
+def conda_package_modules(pdata):
+    '''
+    Returns the module data of a conda package, computed once per
+    name-version-build. The result is shared and must not be modified.
+    '''
+    return conda_package_record(pdata, modules=True)['modules']
+
+
+def conda_package_eggs(pdata):
+    '''
+    Returns the names of the egg/dist-info entries a conda package installs.
+    The module index is not built, so this stays cheap for queries that never
+    resolve imports.
+    '''
+    return conda_package_record(pdata)['eggs']
 
 
 def get_eggs(sp_dir):
     '''
-    Returns a list of all egg files/directories in the given site-packages directory.
+    Returns all egg files/directories in the given site-packages directory.
+    Each entry is read once and cached until its modification time changes,
+    so environments sharing a site-packages directory do not reread it.
 
     Args:
         sp_dir (str): the site packages directory to scan
     Returns:
-        list: a list of the egg files/dirs found in that directory.
+        dict: the package data for each egg file/dir found in that directory.
     '''
+    cache = current_context().cache('eggs')
     results = {}
+    throttle()
     for fn in os.listdir(sp_dir):
-        if not fn.endswith(('.egg-info', '.dist-info', '.egg', '.egg-link')):
+        if not fn.endswith(EGG_EXTENSIONS):
             continue
         fullpath = os.path.join(sp_dir, fn)
-        factory = pkg_resources.dist_factory(sp_dir, fn, False)
         try:
-            dists = list(factory(fullpath))
-        except Exception as e:
-            warn_file(fullpath, 'ERROR READING EGGS', e)
-            dists = []
-        pdata = {'name': None,
-                 'version': None,
-                 'build': '<pip>',
-                 'depends': set(),
-                 'modules': {'python': set(), 'r': set()}}
+            mtime = os.stat(fullpath).st_mtime_ns
+        except OSError:
+            mtime = None
+        entry = cache.get(fullpath)
+        if entry is None or entry[0] != mtime:
+            entry = cache[fullpath] = (mtime, read_distribution(fullpath))
+        # Callers extend the records in place, so each gets its own copy
+        pdata = entry[1].copy()
+        pdata['depends'] = set(pdata['depends'])
+        pdata['modules'] = {k: set(v) for k, v in pdata['modules'].items()}
         results[fn] = pdata
-        for dist in dists:
-            try:
-                if pdata['name'] is None:
-                    pdata['name'] = dist.project_name
-                    pdata['version'] = dist.version or '<dev>'
-                pdata['depends'].update(r.name for r in dist.requires())
-                sources = 'RECORD' if dist.has_metadata('RECORD') else 'SOURCES.txt'
-                if dist.has_metadata(sources) and dist.has_metadata('top_level.txt'):
-                    sources = list(map(str.strip, dist.get_metadata(sources).splitlines()))
-                    top_level = list(map(str.strip, dist.get_metadata('top_level.txt').splitlines()))
-                    for top in top_level:
-                        for src in sources:
-                            src = src.split(',', 1)[0]
-                            if src.endswith('__init__.py'):
-                                src = dirname(src)
-                            elif src.endswith(('.py', '.so')):
-                                src = src[:-3]
-                            else:
-                                continue
-                            pdata['modules']['python'].add(src.replace('/', '.'))
-            except Exception as e:
-                warn_file(fn, 'UNEXPECTED ERROR', e)
-        if not pdata['name']:
-            name, version = fn.rsplit('.', 1)[0], '<dev>'
-            if fn.endswith('.dist-info'):
-                name, version = fn.rsplit('-', 1)
-            elif fn.endswith('.egg-info'):
-                name, version, _ = fn.rsplit('-', 2)
-            pdata['name'], pdata['version'] = name, version
     return results
 
 
-@functools.lru_cache()
+@cached('importables')
 def get_python_importables(path, level=0):
     gen = ()
     modules = {}
@@ -180,6 +243,7 @@ def get_python_importables(path, level=0):
         level -= 1
     root_len = len(root_path) + 1
     for root, dirs, files in gen:
+        throttle()
         dirs[:] = [d for d in dirs if not d.startswith('.') and
                    exists(join(root, d, '__init__.py'))]
         base_module = root[root_len:].replace('/', '.')
@@ -197,7 +261,7 @@ def get_python_importables(path, level=0):
     return modules
 
 
-@functools.lru_cache()
+@cached('local_packages')
 def get_local_packages(path):
     packages = {}
 
@@ -225,6 +289,7 @@ def get_local_packages(path):
         pdata = _create(bname)
         pdata['modules']['python'].add(module)
         pdata['imports']['python'].update(imports)
+    throttle()
     for fpath in glob(join(path, '*.R')) + glob(join(path, '*.ipynb')):
         bname = './' + basename(fpath)
         pdata = _create(bname)
@@ -234,12 +299,13 @@ def get_local_packages(path):
     return packages
 
 
-@functools.lru_cache()
+@cached('environments')
+@timed('environments')
 def environment_by_prefix(envdir, local=None):
     if local is not None:
         envdata = environment_by_prefix(envdir).copy()
         packages = envdata['packages'] = envdata['packages'].copy()
-        imports = envdata['imports'] = envdata['imports'].copy()
+        imports = envdata['imports'] = environment_imports(envdir).copy()
         all_locals = get_local_packages(local)
         for name, package in all_locals.items():
             packages[name] = package.copy()
@@ -262,33 +328,34 @@ def environment_by_prefix(envdir, local=None):
         return envdata
 
     envdata = {'prefix': envdir}
-    imports = envdata['imports'] = {'python': {}, 'r': {}}
     packages = envdata['packages'] = {}
+    sources = envdata['sources'] = []
 
-    # Find all conda-managed modules and attach the conda package name to each.
+    # Find all conda-managed packages. Only the package headers are read here;
+    # the module index is deferred until environment_imports is called.
+    throttle()
     for file in glob(join(envdir, 'conda-meta', '*.json')):
         pdata = parse_conda_meta(file)
-        pname = pdata['name']
-        packages[pname] = pdata
-        for language, mdata in pdata['modules'].items():
-            for module in mdata:
-                imports[language][module] = pname
+        packages[pdata['name']] = pdata
+        sources.append(pdata)
 
     # Find all non-conda egg directories and determine package name and version
-    # If a manifest exists, use that to remove imports from the unmanaged list
+    # If a manifest exists, use that to remove imports from the unmanaged list.
+    # Only the file lists of the conda records show the egg entries a package
+    # installs, so they are read only while some entry remains unaccounted for.
+    # This matches the entry names alone; the module index is still deferred.
     eggfiles = {}
     for spdir in glob(join(envdir, 'lib', 'python*', 'site-packages')):
         eggfiles.update(get_eggs(spdir))
     for pdata in packages.values():
-        for egg in pdata['eggs']:
-            if egg in eggfiles:
-                del eggfiles[egg]
+        if not eggfiles:
+            break
+        if pdata['readable']:
+            for egg in conda_package_eggs(pdata):
+                eggfiles.pop(egg, None)
     for eggfile, pdata in eggfiles.items():
-        pname = pdata['name']
         packages[pdata['name']] = pdata
-        for language, mdata in pdata['modules'].items():
-            for module in mdata:
-                imports[language][module] = pname
+        sources.append(pdata)
 
     # Construct reverse dependency info
     for pkg, pdata in packages.items():
@@ -301,6 +368,38 @@ def environment_by_prefix(envdir, local=None):
     return envdata
 
 
+@cached('environment_imports')
+@timed('environments')
+def environment_imports(envdir):
+    '''
+    Builds the module index of an environment, mapping each importable module
+    to the name of the package that provides it. This requires a full pass
+    through every conda-meta record, so it is only done once import resolution
+    actually needs the environment.
+
+    Args:
+        envdir (str): the prefix of the environment.
+    Returns:
+        dict: a module-to-package dictionary for each language.
+    '''
+    imports = {'python': {}, 'r': {}}
+    for pdata in environment_by_prefix(envdir)['sources']:
+        modules = pdata.get('modules')
+        if modules is None:
+            if not pdata['readable']:
+                continue
+            entry = conda_package_record(pdata, modules=True)
+            modules = entry['modules']
+            if entry['python']:
+                # The builtins belong to this environment's executable
+                for module in get_python_builtins(join(envdir, 'bin', 'python')):
+                    imports['python'][module] = pdata['name']
+        for language, mdata in modules.items():
+            for module in mdata:
+                imports[language][module] = pdata['name']
+    return imports
+
+
 def kernel_name_to_prefix(project_home, kernel_name):
     parent_dir, project_name = os.path.split(project_home)
     project_root, project_user = os.path.split(parent_dir)
@@ -316,16 +415,15 @@ def kernel_name_to_prefix(project_home, kernel_name):
             return join(project_home, 'envs', kernel_loc[len(kernel_base):])
 
 
+# Make sure we get the package that imports the base language
+LANGUAGE_MODULES = {'python': ['math'], 'r': ['stats']}
+
+
 def modules_to_packages(environment, modules, language):
     requested = set()
     missing = set()
     packages = environment['imports'][language]
-    # Make sure we get the package that imports the base language
-    if language == 'python':
-        lang_modules = ['math']
-    else:
-        lang_modules = ['stats']
-    for module in list(modules) + lang_modules:
+    for module in list(modules) + LANGUAGE_MODULES.get(language, ['stats']):
         package = packages.get(module)
         while package is None and '.' in module:
             module = module.rsplit('.', 1)[0]
@@ -335,3 +433,81 @@ def modules_to_packages(environment, modules, language):
         else:
             requested.add(package)
     return (requested, missing)
+
+
+def environment_index(prefixes):
+    '''
+    Creates an inverted module index over the environments of a project.
+    The index maps each module to the set of environments that provide it,
+    represented as a bit mask with one bit per environment. It is filled in
+    as modules are looked up, so only the imported modules are indexed, and
+    only the environments actually consulted have their modules read.
+
+    Args:
+        prefixes (list): the prefixes of the environments.
+    Returns:
+        dict: the index, for use with missing_counts.
+    '''
+    return {'bits': {prefix: 1 << k for k, prefix in enumerate(prefixes)},
+            'masks': {},
+            'locals': {}}
+
+
+def _module_mask(index, module, language, prefix):
+    # Each entry holds the environments checked so far, and those among them
+    # that provide the module
+    key = (language, module)
+    bit = index['bits'][prefix]
+    checked, mask = index['masks'].get(key, (0, 0))
+    if not checked & bit:
+        if module in environment_imports(prefix)[language]:
+            mask |= bit
+        index['masks'][key] = (checked | bit, mask)
+    return mask & bit
+
+
+def _local_modules(index, local, language):
+    key = (local, language)
+    modules = index['locals'].get(key)
+    if modules is None:
+        modules = index['locals'][key] = set()
+        for package in get_local_packages(local).values():
+            modules.update(package['modules'][language])
+    return modules
+
+
+def missing_counts(index, prefixes, local, modules, language):
+    '''
+    Counts the imports that each environment would leave unresolved. The
+    counts equal the number of missing modules modules_to_packages reports
+    for environment_by_prefix(prefix, local), without building those
+    environments. The environments are taken in order, and the counting
+    stops at the first one that resolves every import, since no later one
+    can improve on it; the module indexes of the rest are never built.
+
+    Args:
+        index (dict): the index created by environment_index.
+        prefixes (list): the environments to count, all within the index.
+        local (str): the directory whose local packages are also importable.
+        modules (iterable): the imported modules.
+        language (str): the language of the imports.
+    Returns:
+        list: the number of missing modules for each prefix, up to and
+            including the first prefix with none.
+    '''
+    local_modules = _local_modules(index, local, language)
+    modules = list(modules) + LANGUAGE_MODULES.get(language, ['stats'])
+    counts = []
+    for prefix in prefixes:
+        missing = set()
+        for module in modules:
+            while module not in local_modules and not _module_mask(index, module, language, prefix):
+                if '.' not in module:
+                    # An unresolved import is reported by its top-level module
+                    missing.add(module)
+                    break
+                module = module.rsplit('.', 1)[0]
+        counts.append(len(missing))
+        if not missing:
+            break
+    return counts
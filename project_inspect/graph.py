@@ -0,0 +1,90 @@
+__all__ = ['environment_graph']
+
+
+def dependency_graph(packages):
+    '''
+    Compiles the dependency graph of an environment into integer form. Each
+    package is given an id, and a set of packages is represented by an int
+    with one bit per id, so that set operations become bitwise operations.
+
+    Args:
+        packages (dict): the packages of an environment, as given by
+            environment_by_prefix.
+    Returns:
+        dict: the package names in id order, the id of each name, and the
+            dependency and reverse dependency masks of each package.
+    '''
+    names = sorted(packages)
+    ids = {name: k for k, name in enumerate(names)}
+    depends = [0] * len(names)
+    reverse = [0] * len(names)
+    for k, name in enumerate(names):
+        for dep in packages[name]['depends']:
+            d = ids.get(dep)
+            if d is not None:
+                depends[k] |= 1 << d
+                reverse[d] |= 1 << k
+    return {'packages': packages, 'names': names, 'ids': ids,
+            'depends': depends, 'reverse': reverse}
+
+
+def environment_graph(envdata):
+    '''
+    Returns the compiled dependency graph of an environment, building it on
+    first use. The graph is stored with the environment data, and rebuilt
+    if the package dictionary it was built from has been replaced.
+    '''
+    graph = envdata.get('graph')
+    if graph is None or graph['packages'] is not envdata['packages']:
+        graph = envdata['graph'] = dependency_graph(envdata['packages'])
+    return graph
+
+
+def to_mask(graph, names):
+    ids = graph['ids']
+    mask = 0
+    for name in names:
+        k = ids.get(name)
+        if k is not None:
+            mask |= 1 << k
+    return mask
+
+
+def to_names(graph, mask):
+    '''
+    Returns the names of the packages in a mask, in sorted order.
+    '''
+    names = graph['names']
+    result = []
+    while mask:
+        low = mask & -mask
+        result.append(names[low.bit_length() - 1])
+        mask ^= low
+    return result
+
+
+def closure(adjacency, start, stop=0):
+    '''
+    Returns the packages reachable from the start set through the given
+    adjacency, including the start set itself. Packages in the stop set are
+    included when reached, but their own edges are not followed.
+
+    Args:
+        adjacency (list): the dependency or reverse dependency masks.
+        start (int): the mask of the starting packages.
+        stop (int): the mask of the packages not to expand.
+    Returns:
+        int: the mask of the reachable packages.
+    '''
+    result = start
+    frontier = start & ~stop
+    while frontier:
+        reached = 0
+        while frontier:
+            low = frontier & -frontier
+            reached |= adjacency[low.bit_length() - 1]
+            frontier ^= low
+        reached &= ~result
+        result |= reached
+        frontier = reached & ~stop
+    return result
@@ -1,37 +1,71 @@
+import collections
+import functools
+import hashlib
+import io
+import mmap
+import os
 import re
+import time
 
-from os.path import isfile
+from os.path import isfile, splitext
 
-from lib2to3 import pygram
 from lib2to3 import pytree
-from lib2to3.pgen2 import driver
-from lib2to3.pygram import python_symbols as syms
+from lib2to3.pgen2 import token, tokenize
 
-from .utils import load_file
+from . import config
+from .context import cached, current_context
+from .notebook import kernel_name
+from .throttle import throttle
+from .utils import read_file, run_stats, timed, warn_file
 
 
-def stringify(content):
+class ParseLimitExceeded(Exception):
+    pass
+
+
+@functools.lru_cache()
+def python_grammar():
+    '''
+    Loads the lib2to3 grammars on first use, since loading them is a large
+    part of the startup time of the package.
+
+    Returns:
+        tuple: the grammar symbols, and the Python 3 and Python 2 drivers.
+    '''
+    from lib2to3 import pygram
+    from lib2to3.pgen2 import driver
+    p3_driver = driver.Driver(pygram.python_grammar_no_print_statement, convert=pytree.convert)
+    p2_driver = driver.Driver(pygram.python_grammar, convert=pytree.convert)
+    return pygram.python_symbols, (p3_driver, p2_driver)
+
+
+def stringify(content, syms=None):
+    syms = syms or python_grammar()[0]
     if isinstance(content, list):
-        return ''.join(map(stringify, content))
+        return ''.join(stringify(c, syms) for c in content)
     elif isinstance(content, pytree.Leaf):
         return content.value
     elif isinstance(content, pytree.Node):
         if content.type in (syms.dotted_as_name, syms.import_as_name):
             right = content.children.index(pytree.Leaf(1, 'as'))
-            return stringify(content.children[:right])
+            return stringify(content.children[:right], syms)
         elif content.type == syms.dotted_name:
-            return stringify(content.children)
+            return stringify(content.children, syms)
         else:
             raise RuntimeError('Unexpected: {!r}'.format(content))
 
 
-def yield_imports(node):
+def yield_imports(node, syms=None):
+    syms = syms or python_grammar()[0]
     if node.type == syms.import_from:
         # from a import b as c, d as e, f
         right = node.children.index(pytree.Leaf(1, 'import'))
-        base = stringify(node.children[1:right])
+        base = stringify(node.children[1:right], syms)
         if not base.endswith('.'):
             base += '.'
+        if node.children[right + 1].type == token.LPAR:
+            # from a import (b, c)
+            right += 1
         node = node.children[right + 1]
     elif node.type == syms.import_name:
         # import a, b as c
@@ -39,55 +73,144 @@ def yield_imports(node):
         node = node.children[1]
     else:
         for child in node.children:
-            for value in yield_imports(child):
+            for value in yield_imports(child, syms):
                 yield value
         return
     if node.type in (syms.import_as_names, syms.dotted_as_names):
         for child in node.children[::2]:
-            yield base + stringify(child)
+            yield base + stringify(child, syms)
     else:
-        yield base + stringify(node)
+        yield base + stringify(node, syms)
 
 
-p3_grammar = pygram.python_grammar_no_print_statement
-p3_driver = driver.Driver(p3_grammar, convert=pytree.convert)
-p2_grammar = pygram.python_grammar
-p2_driver = driver.Driver(p2_grammar, convert=pytree.convert)
+def check_deadline(deadline):
+    if deadline is not None and time.monotonic() > deadline:
+        raise ParseLimitExceeded('PARSE TIME LIMIT EXCEEDED')
 
 
-def find_python_imports(code, recurse=True):
-    imports = set()
-    code = code + '\n'
-    try:
-        tree = p3_driver.parse_string(code, debug=False)
-        imports.update(yield_imports(tree))
-    except Exception:
+def timed_tokens(tokens, deadline):
+    for tok in tokens:
+        check_deadline(deadline)
+        yield tok
+
+
+def parse_python(pdriver, code, deadline=None):
+    if deadline is None:
+        return pdriver.parse_string(code, debug=False)
+    tokens = tokenize.generate_tokens(io.StringIO(code).readline)
+    return pdriver.parse_tokens(timed_tokens(tokens, deadline), debug=False)
+
+
+def parse_imports(code, imports, deadline=None):
+    '''
+    Adds the imports in code to the imports set. Returns False if neither
+    the Python 3 nor the Python 2 grammar can parse the code.
+    '''
+    for pdriver in python_grammar()[1]:
         try:
-            tree = p2_driver.parse_string(code, debug=False)
-            imports.update(yield_imports(tree))
+            imports.update(yield_imports(parse_python(pdriver, code, deadline)))
+            return True
+        except ParseLimitExceeded:
+            raise
         except Exception:
-            if recurse:
-                for line in map(str.strip, code.splitlines()):
-                    if line and not line.startswith('#'):
-                        imports.update(find_python_imports(line, False))
+            pass
+    return False
+
+
+IMPORT_WORD = re.compile(r'\bimport\b')
+
+
+def statement_end(lines, start, limit=100):
+    '''
+    Tokenizes the statement beginning on lines[start], which may continue
+    onto following lines through brackets or backslashes. Returns the index
+    of its last line, or start if its end cannot be found within the limit.
+    '''
+    source = iter([lines[start].strip()] + lines[start + 1:start + limit])
+
+    def readline():
+        line = next(source, None)
+        return '' if line is None else line + '\n'
+    try:
+        for tok in tokenize.generate_tokens(readline):
+            if tok[0] == tokenize.NEWLINE:
+                return start + tok[2][0] - 1
+    except (tokenize.TokenError, IndentationError):
+        pass
+    return start
+
+
+def find_line_imports(code, deadline=None):
+    '''
+    The fallback for code that does not parse as a whole. Each line that
+    contains the word import is parsed on its own; if that fails and the
+    statement continues onto later lines, the whole statement is parsed
+    instead. Lines without imports are never handed to the parser.
+    '''
+    imports = set()
+    lines = code.splitlines()
+    for num, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith('#') or not IMPORT_WORD.search(line):
+            continue
+        check_deadline(deadline)
+        if not parse_imports(line + '\n', imports, deadline):
+            last = statement_end(lines, num)
+            if last > num:
+                statement = '\n'.join([line] + lines[num + 1:last + 1])
+                parse_imports(statement + '\n', imports, deadline)
+    return imports
+
+
+def find_python_imports(code, recurse=True, deadline=None):
+    imports = set()
+    if not parse_imports(code + '\n', imports, deadline) and recurse:
+        imports.update(find_line_imports(code, deadline))
+    return imports
+
+
+IMPORT_MATCH = re.compile(r'^[ \t]*(?:from[ \t]+([\w.]+)[ \t]+import[ \t]*|import[ \t]+)'
+                          r'(\([^)]*\)|[^#;\n]*)', re.M)
+COMMENT_MATCH = re.compile(r'#[^\n]*')
+
+
+def scan_python_imports(code):
+    '''
+    A linear-time approximation of find_python_imports, used for files that
+    exceed the parsing limits. It only recognizes import statements at the
+    start of a line, and may pick up import-like lines inside strings.
+    '''
+    imports = set()
+    for base, names in IMPORT_MATCH.findall(code):
+        if base and not base.endswith('.'):
+            base += '.'
+        names = COMMENT_MATCH.sub('', names).strip('()\\ \t\n')
+        for name in names.split(','):
+            name = name.split(' as ', 1)[0].strip()
+            if name == '*' or name and all(part.isidentifier() for part in name.split('.')):
+                imports.add(base + name)
     return imports
 
 
 R_PKGNAME = r'[a-zA-Z][a-zA-Z0-9.]*[a-zA-Z0-9]'
-LIB_MATCH = (r'library\s*\(\s*["{0}]?(' + R_PKGNAME + r')["{0}]?\s*\)').format("'")
-COLON_MATCH = r'.*?(' + R_PKGNAME + r')\s*::\s*[a-zA-Z]'
-EITHER_MATCH = LIB_MATCH + r'|' + COLON_MATCH
+R_SPACE = r'[^\S\n]*'
+COMMENT_LINE = r'^' + R_SPACE + r'#[^\n]*'
+LIB_MATCH = (r'(?:library|require){0}\({0}["{1}]?(' + R_PKGNAME + r')["{1}]?{0}\)').format(R_SPACE, "'")
+# A package name never starts right after a letter, since the match would
+# then have started earlier; the lookbehind avoids retrying inside words.
+COLON_MATCH = (r'(?<![a-zA-Z])(' + R_PKGNAME + r'){0}::{0}[a-zA-Z]').format(R_SPACE)
+R_MATCH = re.compile(COMMENT_LINE + r'|' + LIB_MATCH + r'|' + COLON_MATCH, re.M)
 
 
 def find_r_imports(code):
+    if isinstance(code, list):
+        code = '\n'.join(code)
     modules = set()
-    if not isinstance(code, list):
-        code = code.splitlines()
-    for line in code:
-        if not re.match(r'\s*#', line):
-            for match in re.findall(EITHER_MATCH, line):
-                modules.update(match)
-        modules.discard('')
+    # A single pass over the whole file; lines starting with # are skipped
+    # by the first alternative, which matches them in full.
+    for match in R_MATCH.findall('\n'.join(code.splitlines())):
+        modules.update(match)
+    modules.discard('')
     return modules
 
 
@@ -101,7 +224,12 @@ def strip_python_magic(cell):
             yield c
 
 
-def find_notebook_imports(ndata):
+def check_size(code):
+    if config.MAX_PARSE_SIZE and len(code) > config.MAX_PARSE_SIZE:
+        raise ParseLimitExceeded('PARSE SIZE LIMIT EXCEEDED')
+
+
+def find_notebook_imports(ndata, deadline=None, scan=False):
     try:
         language = ndata['metadata']['kernelspec']['language'].lower()
     except (KeyError, TypeError):
@@ -113,26 +241,179 @@ def find_notebook_imports(ndata):
             if cell['cell_type'] == 'code':
                 if language == 'python':
                     source = '\n'.join(strip_python_magic(cell['source']))
-                    processor = find_python_imports
+                    if scan:
+                        modules.update(scan_python_imports(source))
+                    else:
+                        check_size(source)
+                        modules.update(find_python_imports(source, deadline=deadline))
                 elif language == 'r':
                     source = '\n'.join(cell['source'])
-                    processor = find_r_imports
-                modules.update(processor(source))
+                    modules.update(find_r_imports(source))
     return modules, language
 
 
-def find_file_imports(fpath, submodules=False, locals=False):
-    if not isfile(fpath) or not fpath.endswith(('.ipynb', '.py', '.R')):
-        return set(), None
-    data = load_file(fpath)
+def parse_deadline():
+    if config.MAX_PARSE_TIME:
+        return time.monotonic() + config.MAX_PARSE_TIME
+
+
+def parse_limited(fpath, exc):
+    warn_file(fpath, '{}; using the fallback import scan'.format(exc))
+    run_stats['files_parse_limited'] += 1
+
+
+# Files up to this size are identified by a hash of their first block alone
+SCREEN_SIZE = 1 << 14
+
+
+def _hash(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _file_digest(fpath):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(fpath, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            throttle(len(block), ops=0)
+            digest.update(block)
+    throttle()
+    return digest.digest()
+
+
+def _analyze(cache, key, analyze, fpath, contents):
+    entry = cache.get(key)
+    if entry is None:
+        result = analyze(fpath, contents)
+        if result[0] is not None:
+            cache[key] = result
+        return result
+    # A copy of a file already analyzed; only its warnings are repeated
+    run_stats['parses_avoided'] += 1
+    if entry[1] is not None:
+        parse_limited(fpath, entry[1])
+    return entry
+
+
+def analyze_content(fpath, analyze):
+    '''
+    Memoizes the analysis of a file by its content, so that identical copies
+    anywhere on the node are only parsed once. Files are first screened by
+    their size and a hash of their first block; the whole file is hashed
+    only when the screen matches another file, and for a first match, the
+    earlier file is hashed as well. The file is read only once: the first
+    block holds all of a small file, and a larger one is memory mapped, so
+    that the hash and the parse share the rest of it.
+
+    Args:
+        fpath (str): the file to analyze.
+        analyze (function): given the file and its contents, or None if it
+            must read them itself, returns the result for the file, along
+            with the parse limit exception that was hit, if any. A result of
+            None, for an unreadable file, is not memoized.
+    Returns:
+        tuple: the return value of analyze.
+    '''
+    cache = current_context().cache('contents')
+    # The parse limits can change the result, so they are part of the key
+    kind = (splitext(fpath)[1], config.MAX_PARSE_SIZE, config.MAX_PARSE_TIME)
+    try:
+        with open(fpath, 'rb') as fp:
+            size = os.fstat(fp.fileno()).st_size
+            head = fp.read(SCREEN_SIZE)
+            throttle(len(head))
+            if size <= SCREEN_SIZE:
+                return _analyze(cache, ('digest', kind, _hash(head)), analyze, fpath, head)
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                throttle(len(contents) - len(head), ops=0)
+                screen = ('screen', kind, size, _hash(head))
+                first = cache.get(screen)
+                if first is None:
+                    result = analyze(fpath, contents)
+                    if result[0] is not None:
+                        cache[screen] = (fpath, os.fstat(fp.fileno()).st_mtime_ns, result)
+                    return result
+                if first is not True:
+                    fpath0, mtime, entry = first
+                    cache[screen] = True
+                    if os.stat(fpath0).st_mtime_ns == mtime:
+                        cache[('digest', kind, _file_digest(fpath0))] = entry
+                return _analyze(cache, ('digest', kind, _hash(contents)), analyze, fpath, contents)
+    except (OSError, ValueError):
+        # ValueError is raised by mmap if the file was truncated
+        return analyze(fpath, None)
+
+
+NotebookInfo = collections.namedtuple('NotebookInfo', ('language', 'kernel', 'imports'))
+
+
+@timed('parse')
+def _analyze_notebook(fpath, contents=None):
+    ndata = read_file(fpath, contents=contents)
+    if ndata is None:
+        return None, None
+    run_stats['files_parsed'] += 1
+    limit = None
+    try:
+        imports, language = find_notebook_imports(ndata, parse_deadline())
+    except ParseLimitExceeded as e:
+        parse_limited(fpath, e)
+        imports, language = find_notebook_imports(ndata, scan=True)
+        limit = e
+    kernel = kernel_name(ndata)
+    return NotebookInfo(language, kernel, frozenset(imports)), limit
+
+
+@cached('notebooks')
+def analyze_notebook(fpath):
+    '''
+    Reads a notebook once, extracting everything the inventory needs from
+    it. The result is small, so unlike the notebook data it is retained for
+    the whole run, and the metadata lookup and import scan share it. Copies
+    of the same notebook are only parsed once; see analyze_content.
+
+    Returns:
+        NotebookInfo: the kernel language (or 'unknown'), the kernel name
+        (or None if the kernelspec is incomplete), and the modules imported
+        by the code cells, including submodules and local imports. None is
+        returned if the notebook cannot be read.
+    '''
+    return analyze_content(fpath, _analyze_notebook)[0]
+
+
+@timed('parse')
+def _analyze_source(fpath, contents=None):
+    data = read_file(fpath, contents=contents)
     if data is None:
-        return set(), None
-    elif fpath.endswith('.ipynb'):
-        imports, language = find_notebook_imports(data)
-    elif fpath.endswith('.py'):
-        imports, language = find_python_imports(data), 'python'
+        return None, None
+    run_stats['files_parsed'] += 1
+    limit = None
+    if fpath.endswith('.py'):
+        try:
+            check_size(data)
+            imports = find_python_imports(data, deadline=parse_deadline())
+        except ParseLimitExceeded as e:
+            parse_limited(fpath, e)
+            imports = scan_python_imports(data)
+            limit = e
+        language = 'python'
     else:  # .R
         imports, language = find_r_imports(data), 'r'
+    return (frozenset(imports), language), limit
+
+
+def find_file_imports(fpath, submodules=False, locals=False):
+    if not isfile(fpath) or not fpath.endswith(('.ipynb', '.py', '.R')):
+        return set(), None
+    if fpath.endswith('.ipynb'):
+        info = analyze_notebook(fpath)
+        if info is None:
+            return set(), None
+        imports, language = set(info.imports), info.language
+    else:
+        result = analyze_content(fpath, _analyze_source)[0]
+        if result is None:
+            return set(), None
+        imports, language = set(result[0]), result[1]
     if language == 'python':
         if not submodules:
             imports = set('.' if imp.startswith('.') else imp.split('.', 1)[0] for imp in imports)
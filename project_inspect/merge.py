@@ -0,0 +1,136 @@
+import csv
+import sys
+
+from os.path import basename
+
+from .project import COLUMNS, SUMMARY_COLUMNS, parse_package_spec, summary_grouping
+from .version import VersionSpec
+
+__all__ = ['merge_inventories', 'summarize_records']
+
+
+def parse_source(source):
+    '''
+    Splits a merge source of the form NODE=PATH. If the node name is
+    omitted, the base name of the file without its extension is used.
+    '''
+    if '=' in source:
+        node, fpath = source.split('=', 1)
+    else:
+        fpath = source
+        node = basename(fpath).split('.', 1)[0]
+    return node, fpath
+
+
+def read_inventory(fpath):
+    with open(fpath, 'rt', newline='') as fp:
+        reader = csv.reader(fp)
+        header = next(reader, None)
+        if header is None:
+            return
+        if tuple(header) != COLUMNS:
+            raise RuntimeError('{}: not an unsummarized inventory'.format(fpath))
+        for row in reader:
+            if row:
+                yield row
+
+
+def record_filter(packages):
+    '''
+    Builds a row predicate equivalent to filter_data for the given specs.
+    Version matches are memoized, so the cost is bounded by the number of
+    distinct package versions rather than the number of rows.
+    '''
+    specs = {}
+    for package in packages:
+        name, version = parse_package_spec(package)
+        specs.setdefault(name, []).append(VersionSpec(version) if version else None)
+    matches = {}
+
+    def _filter(package, version):
+        vspecs = specs.get(package)
+        if vspecs is None:
+            return False
+        key = (package, version)
+        result = matches.get(key)
+        if result is None:
+            result = matches[key] = any(vspec is None or vspec.match(version) for vspec in vspecs)
+        return result
+    return _filter
+
+
+def merge_inventories(sources, packages=None):
+    '''
+    Streams the records of several inventory files, prepending the node
+    name to each record. Only one record is held in memory at a time.
+
+    Args:
+        sources (list): inventory files, optionally given as NODE=PATH.
+        packages (list): package specs, as accepted by filter_data.
+    Yields:
+        list: the node name followed by the inventory columns.
+    '''
+    match = record_filter(packages) if packages else None
+    for source in sources:
+        node, fpath = parse_source(source)
+        for row in read_inventory(fpath):
+            if match is None or match(row[3], row[4]):
+                yield [node] + row
+
+
+def summarize_records(records, level):
+    '''
+    Computes the equivalent of summarize_data over a stream of merged
+    records. Memory is proportional to the size of the summary.
+
+    Args:
+        records (iterable): records as produced by merge_inventories.
+        level (str): a summary level, as accepted by summarize_data.
+    Returns:
+        DataFrame: the summary.
+    '''
+    import pandas as pd
+    grouping, left, right = summary_grouping(level, nodes=True)
+    columns = ('node',) + COLUMNS
+    indices = [columns.index(g) for g in grouping]
+    # Only keep the distinct sets that will actually be reported
+    keep = [k >= left for k in range(3)]
+    groups = {}
+    for record in records:
+        key = tuple(record[k] for k in indices)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = [set(), set(), set(), 0, 0, 0, 0]
+        owner = tuple(record[:2])
+        if keep[0]:
+            group[0].add(owner)
+        if keep[1]:
+            group[1].add(owner + (record[2],))
+        if keep[2]:
+            group[2].add(owner + (record[2], record[3]))
+        group[3] += record[7] == 'True'
+        group[4] += record[8] == 'True'
+        group[5] += record[4] == 'python'
+        group[6] += record[4] == 'r-base'
+    if not grouping and not groups:
+        groups[()] = [set(), set(), set(), 0, 0, 0, 0]
+    result = []
+    for key in sorted(groups):
+        group = groups[key]
+        values = [len(v) for v in group[:3]] + group[3:]
+        result.append(list(key) + values[left:right])
+    return pd.DataFrame(result, columns=grouping + list(SUMMARY_COLUMNS[left:right]))
+
+
+def write_records(records, fname=None):
+    if fname and fname != '-':
+        with open(fname, 'wt', newline='') as fp:
+            _write_records(records, fp)
+    else:
+        _write_records(records, sys.stdout)
+
+
+def _write_records(records, fp):
+    writer = csv.writer(fp, lineterminator='\n')
+    writer.writerow(('node',) + COLUMNS)
+    writer.writerows(records)
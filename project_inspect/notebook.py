@@ -0,0 +1,248 @@
+import json
+import mmap
+import re
+
+from .throttle import throttle
+
+__all__ = ['kernel_name', 'load_kernel_name', 'load_members', 'load_notebook', 'parse_notebook']
+
+
+STRING = rb'"[^"\\\x00-\x1f]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*)*"'
+TOKEN = re.compile(rb'[ \t\n\r]*(' + STRING + rb'|[{}\[\]:,]'
+                   rb'|-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?'
+                   rb'|true|false|null|NaN|-?Infinity)')
+# Everything inside a skipped container except for strings and brackets
+SKIP = re.compile(rb'[ \t\n\r,:\w.+\-]*')
+SPACE = re.compile(rb'[ \t\n\r]*')
+CLOSERS = {b'{': b'}', b'[': b']'}
+
+
+def _next(buf, pos):
+    match = TOKEN.match(buf, pos)
+    if match is None:
+        raise ValueError('Invalid JSON at offset {}'.format(pos))
+    return match.group(1), match.end()
+
+
+def _skip_string(buf, pos):
+    '''
+    Returns the offset just past the end of the string whose opening quote
+    precedes pos. The search for the closing quote is a plain byte search,
+    which is much faster than a regular expression on long strings.
+    '''
+    while True:
+        end = buf.find(b'"', pos)
+        if end < 0:
+            raise ValueError('Unterminated string at offset {}'.format(pos - 1))
+        start = end
+        while buf[start - 1] == 0x5c:  # backslash
+            start -= 1
+        pos = end + 1
+        if (end - start) % 2 == 0:
+            return pos
+
+
+def _skip(buf, pos):
+    '''
+    Skips over the value starting at pos, without decoding it. Within a
+    skipped container, only the nesting of the brackets and the termination
+    of the strings are checked.
+
+    Returns:
+        tuple: the start and end offsets of the value.
+    '''
+    token, end = _next(buf, pos)
+    start = end - len(token)
+    if token in CLOSERS:
+        stack = [CLOSERS[token]]
+        while stack:
+            end = SKIP.match(buf, end).end()
+            char = buf[end:end + 1]
+            end += 1
+            if char == b'"':
+                end = _skip_string(buf, end)
+            elif char in CLOSERS:
+                stack.append(CLOSERS[char])
+            elif char and char == stack[-1]:
+                stack.pop()
+            else:
+                raise ValueError('Invalid JSON at offset {}'.format(end - 1))
+    elif token in (b'}', b']', b':', b','):
+        raise ValueError('Invalid JSON at offset {}'.format(start))
+    return start, end
+
+
+def _value(buf, pos):
+    start, end = _skip(buf, pos)
+    return json.loads(buf[start:end].decode('utf-8')), end
+
+
+def _object(buf, pos, fields, partial=False):
+    '''
+    Reads the members of an object whose opening brace ends at pos,
+    decoding only the members named in fields and skipping the rest.
+
+    Args:
+        fields (dict): a reader function for each member to keep.
+        partial (bool): if True, stop once every member in fields has been
+            read, leaving the rest of the object unread.
+    Returns:
+        tuple: the object and the offset of its end.
+    '''
+    result = {}
+    token, pos = _next(buf, pos)
+    if token == b'}':
+        return result, pos
+    while True:
+        if not token.startswith(b'"'):
+            raise ValueError('Expected an object key at offset {}'.format(pos - len(token)))
+        key = json.loads(token.decode('utf-8'))
+        token, pos = _next(buf, pos)
+        if token != b':':
+            raise ValueError('Expected a colon at offset {}'.format(pos - len(token)))
+        reader = fields.get(key)
+        if reader is None:
+            _, pos = _skip(buf, pos)
+        else:
+            result[key], pos = reader(buf, pos)
+            if partial and len(result) == len(fields):
+                return result, pos
+        token, pos = _next(buf, pos)
+        if token == b'}':
+            return result, pos
+        elif token != b',':
+            raise ValueError('Expected a comma at offset {}'.format(pos - len(token)))
+        token, pos = _next(buf, pos)
+
+
+def _select(fields):
+    def _reader(buf, pos):
+        token, end = _next(buf, pos)
+        if token == b'{':
+            return _object(buf, end, fields)
+        return _value(buf, pos)
+    return _reader
+
+
+def _array(reader):
+    def _reader(buf, pos):
+        token, end = _next(buf, pos)
+        if token != b'[':
+            return _value(buf, pos)
+        result = []
+        token, next_pos = _next(buf, end)
+        if token == b']':
+            return result, next_pos
+        pos = end
+        while True:
+            value, pos = reader(buf, pos)
+            result.append(value)
+            token, pos = _next(buf, pos)
+            if token == b']':
+                return result, pos
+            elif token != b',':
+                raise ValueError('Expected a comma at offset {}'.format(pos - len(token)))
+    return _reader
+
+
+METADATA_FIELDS = {
+    'metadata': _select({'kernelspec': _value}),
+}
+NOTEBOOK_FIELDS = dict(METADATA_FIELDS,
+                       cells=_array(_select({'cell_type': _value, 'source': _value})))
+
+
+def _parse(buf, fields, partial=False):
+    # Returns the document and the offset where reading stopped
+    pos = 3 if buf[:3] == b'\xef\xbb\xbf' else 0
+    token, end = _next(buf, pos)
+    if token == b'{':
+        result, pos = _object(buf, end, fields, partial)
+        if partial and len(result) == len(fields):
+            return result, pos
+    else:
+        result, pos = _value(buf, pos)
+    if SPACE.match(buf, pos).end() != len(buf):
+        raise ValueError('Extra data at offset {}'.format(pos))
+    return result, len(buf)
+
+
+def _load(fpath, fields, partial=False):
+    # The file is memory mapped, so the skipped parts are never copied
+    with open(fpath, 'rb') as fp:
+        if not fp.seek(0, 2):
+            return _parse(b'', fields, partial)
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return _parse(buf, fields, partial)
+
+
+def parse_notebook(buf):
+    '''
+    Extracts the parts of a notebook needed for import scanning: the
+    kernelspec from its metadata, and the type and source of each cell.
+    Everything else, including the cell outputs, is skipped without being
+    decoded. Well-formed notebooks produce the same values as json.loads.
+
+    Args:
+        buf (bytes): the notebook contents, or a memory map of them.
+    Returns:
+        dict: the notebook, with only the fields listed above.
+    Raises:
+        ValueError: if the data is not valid JSON.
+    '''
+    return _parse(buf, NOTEBOOK_FIELDS)[0]
+
+
+def load_notebook(fpath):
+    '''
+    Parses a notebook file with parse_notebook. The file is memory mapped,
+    so the skipped parts of the file are never copied into memory.
+    '''
+    return _load(fpath, NOTEBOOK_FIELDS)[0]
+
+
+def load_members(fpath, names):
+    '''
+    Reads the named members of the JSON object in a file, skipping the rest
+    of the file without decoding it.
+
+    Args:
+        fpath (str): the JSON file.
+        names (iterable): the top-level members to decode.
+    Returns:
+        dict: the members present in the file. A file holding something
+            other than an object is returned whole.
+    Raises:
+        ValueError: if the data is not valid JSON.
+    '''
+    return _load(fpath, dict.fromkeys(names, _value))[0]
+
+
+def kernel_name(ndata):
+    '''
+    Returns the kernel name in the kernelspec of a notebook, or None if the
+    kernelspec is missing, or lacks a name or a language.
+    '''
+    try:
+        kernelspec = ndata['metadata']['kernelspec']
+        language, name = kernelspec['language'], kernelspec['name']
+    except (KeyError, TypeError):
+        return None
+    return name if isinstance(language, str) else None
+
+
+def load_kernel_name(fpath):
+    '''
+    Reads the kernel name of a notebook file, as given by kernel_name,
+    decoding nothing but the kernelspec. The file is read no further than
+    the end of its metadata, so the rest of it is not checked, and only the
+    bytes up to there are charged to the throttle. Unreadable notebooks give
+    None.
+    '''
+    try:
+        ndata, end = _load(fpath, METADATA_FIELDS, partial=True)
+    except (OSError, ValueError):
+        throttle()
+        return None
+    throttle(end)
+    return kernel_name(ndata)
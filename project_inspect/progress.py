@@ -0,0 +1,155 @@
+import json
+import logging
+import sys
+import time
+
+from .context import current_context
+from .utils import run_stats
+
+__all__ = ['ProgressMeter', 'TimingLog']
+
+
+def _duration(seconds):
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return '{}h{:02}m'.format(seconds // 3600, seconds % 3600 // 60)
+    return '{}m{:02}s'.format(seconds // 60, seconds % 60)
+
+
+class _ClearLine(logging.Filter):
+    '''
+    Erases the status line before a log message is written to the same
+    stream, so that the message starts on a clean line.
+    '''
+
+    def __init__(self, meter):
+        super(_ClearLine, self).__init__()
+        self.meter = meter
+
+    def filter(self, record):
+        self.meter.clear()
+        return True
+
+
+class ProgressMeter(object):
+    '''
+    Displays the progress of a scan as a single status line on standard
+    error: the projects completed, the rate at which files are parsed, the
+    environments loaded, the cache hit rate, and the estimated time to
+    completion. The line is redrawn at most once per interval, and only if
+    the stream is a terminal; otherwise the meter does nothing.
+
+    Args:
+        total (int): the number of projects to be scanned.
+        stream (file): the stream to write to.
+        interval (float): the minimum number of seconds between redraws.
+    '''
+
+    def __init__(self, total, stream=None, interval=0.5):
+        self.total = total
+        self.stream = sys.stderr if stream is None else stream
+        self.interval = interval
+        self.enabled = self.stream.isatty()
+        self.done = 0
+        self.start = time.monotonic()
+        self.files = run_stats['files_parsed']
+        self.shown = None
+        self.last = 0.0
+        self._filter = _ClearLine(self)
+        self._handlers = []
+        if self.enabled:
+            for handler in logging.getLogger().handlers + logging.getLogger('project_inspect').handlers:
+                if getattr(handler, 'stream', None) is self.stream:
+                    handler.addFilter(self._filter)
+                    self._handlers.append(handler)
+
+    def status(self):
+        '''
+        Returns the text of the status line.
+        '''
+        elapsed = time.monotonic() - self.start
+        context = current_context()
+        hits = misses = 0
+        for stats in context.stats(size=False).values():
+            hits += stats['hits']
+            misses += stats['misses']
+        parts = ['{}/{} projects'.format(self.done, self.total),
+                 '{:.1f} files/s'.format((run_stats['files_parsed'] - self.files) / elapsed if elapsed else 0),
+                 '{} envs loaded'.format(context.cache('environments').misses),
+                 'cache hits {}'.format('{:.0%}'.format(hits / (hits + misses)) if hits + misses else '-')]
+        if self.done and self.done < self.total:
+            parts.append('ETA {}'.format(_duration(elapsed / self.done * (self.total - self.done))))
+        return ', '.join(parts)
+
+    def update(self, result=None):
+        '''
+        Records the completion of a project, and redraws the status line if
+        the interval has passed.
+
+        Args:
+            result (dict): the project result, as yielded by
+                iter_node_inventory; not otherwise used.
+        '''
+        self.done += 1
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self.last >= self.interval or self.done == self.total:
+            self.last = now
+            self.draw()
+
+    def draw(self):
+        self.shown = self.status()
+        self.stream.write('\r' + self.shown + '\x1b[K')
+        self.stream.flush()
+
+    def clear(self):
+        if self.shown is not None:
+            self.stream.write('\r\x1b[K')
+            self.stream.flush()
+            self.shown = None
+
+    def close(self):
+        '''
+        Leaves the final status on its own line, and stops clearing the line
+        for log messages.
+        '''
+        if self.enabled:
+            if self.shown is None:
+                self.draw()
+            self.stream.write('\n')
+            self.stream.flush()
+            self.shown = None
+        for handler in self._handlers:
+            handler.removeFilter(self._filter)
+        self._handlers = []
+
+
+class TimingLog(object):
+    '''
+    Writes one JSON line per project with the time and work its scan took,
+    so that the projects dominating a scan can be found without profiling.
+    Each line has the owner, project, status, wall time, and the statistics
+    given by iter_node_inventory. The environment load time includes the
+    parsing of the local packages of the project, so the two overlap.
+
+    Args:
+        fpath (str): the file to write, or '-' for standard error.
+    '''
+
+    def __init__(self, fpath):
+        self.fp = sys.stderr if fpath == '-' else open(fpath, 'wt')
+
+    def update(self, result):
+        record = {'owner': result['owner'],
+                  'project': result['project'],
+                  'status': result['status'],
+                  'wall_time': round(result['time'], 6)}
+        for key, value in result['stats'].items():
+            record[key] = round(value, 6) if isinstance(value, float) else value
+        self.fp.write(json.dumps(record) + '\n')
+        self.fp.flush()
+
+    def close(self):
+        if self.fp is not sys.stderr:
+            self.fp.close()
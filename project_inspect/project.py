@@ -1,16 +1,22 @@
 from . import config
-from .environments import environment_by_prefix, kernel_name_to_prefix, modules_to_packages
+from .context import current_context
+from .environments import (environment_by_prefix, environment_index, get_local_packages,
+                           kernel_name_to_prefix, missing_counts, modules_to_packages)
 
-from .utils import logger, warn_file, load_file, shortpath, set_log_root, wrap
-from .version import VersionSpec
+from .graph import closure, environment_graph, to_mask, to_names
+from .imports import analyze_notebook
+from .notebook import load_kernel_name
+from .throttle import io_stats, throttle
+from .utils import logger, run_stats, run_times, warn_file, shortpath, set_log_root, wrap
+from .version import VersionOrder, VersionSpec
 
 from os.path import join, isdir, basename, dirname, exists, abspath
 from glob import glob
 
+import json
 import os
 import re
-import pandas as pd
-import numpy as np
+import time
 
 
 def visible_project_environments(project_home):
@@ -34,15 +40,13 @@ def visible_project_environments(project_home):
 
 
 def find_notebook_metadata(fpath):
-    ndata = load_file(fpath)
-    try:
-        kspec = ndata['metadata']['kernelspec']
-        return kspec['language'].lower(), kspec['name']
-    except Exception:
+    info = analyze_notebook(fpath)
+    if info is None or info.kernel is None:
         return None, None
+    return info.language, info.kernel
 
 
-def find_used_packages(fpath, project_home, prefixes):
+def find_used_packages(fpath, project_home, prefixes, index=None):
     if isdir(fpath) and exists(join(fpath, '__init__.py')):
         language = 'python'
     elif fpath.endswith('.py'):
@@ -67,6 +71,15 @@ def find_used_packages(fpath, project_home, prefixes):
         return (None, None, None, None)
     package_name = './' + basename(fpath)
     fdir = dirname(fpath)
+    prefixes = list(prefixes)
+    if index is not None and len(prefixes) > 1 and all(p in index['bits'] for p in prefixes):
+        # Choose the environment with the fewest missing imports, the first
+        # one winning ties, and only build that environment
+        package = get_local_packages(fdir).get(package_name)
+        if package is None:
+            return (None, None, None, None)
+        counts = missing_counts(index, prefixes, fdir, package['imports'][language], language)
+        prefixes = [prefixes[counts.index(min(counts))]]
     best = None
     for prefix in prefixes:
         environment = environment_by_prefix(prefix, fdir)
@@ -108,6 +121,33 @@ def sort_candidates(depends):
     return heads + list(edges) + tails[::-1]
 
 
+def walk_project(project_home, warn=True):
+    for root, dirs, files in os.walk(project_home, topdown=True):
+        throttle()
+        # Do not descend into dotted directories, Python package directories,
+        # or the "envs" or "examples" directories
+        if root != project_home and 'envs' in dirs:
+            if warn:
+                warn_file(join(root, 'envs'), 'NESTED ENVIRONMENTS')
+            dirs.remove('envs')
+        dirs[:] = [file for file in dirs if not file.startswith('.') and
+                   not exists(join(root, file, '__init__.py')) and
+                   (root != project_home or file not in ('envs', 'pkgs', 'examples'))]
+        yield root, dirs, files
+
+
+def project_size(project_home):
+    size = 0
+    for root, dirs, files in walk_project(project_home, warn=False):
+        for file in files:
+            if file.endswith(('.py', '.R', '.ipynb')):
+                try:
+                    size += os.stat(join(root, file)).st_size
+                except OSError:
+                    pass
+    return size
+
+
 def find_project_imports(project_home):
     project_name = basename(project_home)
     project_user = basename(dirname(project_home))
@@ -118,7 +158,8 @@ def find_project_imports(project_home):
         all_envs[prefix] = {
             'shortname': shortname,
             'requested': set(),
-            'missing': {}}
+            'missing': {},
+            'files': {}}
     if all_envs:
         logger.info('  {} visible environments:'.format(len(all_envs)))
         for prefix, envrec in all_envs.items():
@@ -128,9 +169,11 @@ def find_project_imports(project_home):
         all_envs['@'] = {
             'shortname': '<empty>',
             'requested': set(),
-            'missing': {}
+            'missing': {},
+            'files': {}
         }
 
+    index = environment_index(all_envs)
     local_envs = {}
     local_depends = {}
 
@@ -154,6 +197,7 @@ def find_project_imports(project_home):
         for pkg in file_requests:
             (local_imports if pkg.startswith('./') else env_imports).add(pkg)
         logger.info('  {}: {}, environment: {}'.format(fbase, language, envrec['shortname']))
+        envrec['files'][fbase] = (language, file_requests, file_missing)
         if env_imports:
             logger.info(wrap('packages: {}'.format(', '.join(sorted(env_imports)))))
             envrec['requested'].update(env_imports)
@@ -167,29 +211,21 @@ def find_project_imports(project_home):
             envrec['missing'].setdefault(language, set()).update(file_missing)
 
     root_len = len(project_home.rstrip('/')) + 1
-    for root, dirs, files in os.walk(project_home, topdown=True):
-        # Do not descend into dotted directories, Python package directories,
-        # or the "envs" or "examples" directories
-        if root != project_home and 'envs' in dirs:
-            warn_file(join(root, 'envs'), 'NESTED ENVIRONMENTS')
-            dirs.remove('envs')
-        dirs[:] = [file for file in dirs if not file.startswith('.') and
-                   not exists(join(root, file, '__init__.py')) and
-                   (root != project_home or file not in ('envs', 'pkgs', 'examples'))]
-
+    for root, dirs, files in walk_project(project_home):
         local_depends.clear()
         for pkg, pdata in environment_by_prefix('@', root)['packages'].items():
             local_depends[pkg[2:]] = set(dep[2:] for dep in pdata['depends'])
         scan_targets = sort_candidates(local_depends)
 
         for file in scan_targets:
+            run_stats['files_scanned'] += 1
             fpath = join(root, file)
             envs = local_envs.get(file) or all_envs
             try:
-                env_prefix, language, t_requests, t_missing = find_used_packages(fpath, project_home, envs)
+                env_prefix, language, t_requests, t_missing = find_used_packages(fpath, project_home, envs, index)
                 _process(fpath, env_prefix, language, t_requests, t_missing)
             except Exception as e:
-                warn_file(fpath, 'UNEXPECTED ERROR', e)
+                warn_file(fpath, 'UNEXPECTED ERROR', e, error=True)
 
     if any(envrec['requested'] or envrec['missing'] for envrec in all_envs.values()):
         logger.info('Summary:')
@@ -203,48 +239,120 @@ def find_project_imports(project_home):
     return all_envs
 
 
-def all_children(packages, children, field, filter=None):
-    nresult = 0
-    result = set(children)
-    while nresult != len(result):
-        nresult = len(result)
-        for pkg in list(result):
-            if filter is None or pkg not in filter:
-                result.update(packages.get(pkg, {}).get(field, ()))
-    if filter is not None:
-        result.intersection_update(filter)
-    return result
-
+SCHEDULES = ('alphabetical', 'locality')
 
 COLUMNS = ('owner', 'project', 'environment', 'package', 'version',
            'build', 'required', 'requested', 'required_by')
 
 
 def _build_df(records):
+    import pandas as pd
     df = pd.DataFrame.from_records(records, columns=COLUMNS)
     df['required'] = df['required'].astype('bool')
     df['requested'] = df['requested'].astype('bool')
     return df
 
 
+def parse_package_spec(package):
+    spec = re.match(r'^([A-Za-z0-9-_.]+)\s*(.*)', package)
+    if not spec:
+        raise RuntimeError('Invalid package spec: {}'.format(package))
+    return spec.groups()
+
+
 def filter_data(df, packages):
     if not packages:
         return df
+    import numpy as np
+    import pandas as pd
     mask = np.zeros(len(df), dtype=bool)
     for package in packages:
-        spec = re.match(r'^([A-Za-z0-9-_.]+)\s*(.*)', package)
-        if not spec:
-            raise RuntimeError('Invalid package spec: {}'.format(package))
-        name, version = spec.groups()
+        name, version = parse_package_spec(package)
         t_mask = df['package'] == name
         if t_mask.any() and version:
             vspec = VersionSpec(version)
-            t2_mask = df['version'][t_mask].apply(vspec.match).values
-            t_mask[t_mask] = t2_mask
+            # Match each distinct version once
+            codes, uniques = pd.factorize(df['version'][t_mask])
+            matches = np.array([vspec.match(v) for v in uniques], dtype=bool)
+            t_mask[t_mask] = matches[codes]
         mask = mask | t_mask
     return df[mask]
 
 
+def version_key(version):
+    '''
+    Returns the sort key of a version string, or None if it is not a valid
+    conda version, such as the '<local>' version of local packages.
+    '''
+    try:
+        return VersionOrder(version).key
+    except ValueError:
+        return None
+
+
+def version_ranks(versions):
+    '''
+    Ranks a column of version strings by version order. Keys are computed
+    once per distinct version, and versions that compare equal, such as
+    1.1 and 1.1.0, receive the same rank.
+
+    Args:
+        versions (Series): the version strings.
+    Returns:
+        ndarray: the rank of each version. Invalid versions rank -1.
+    '''
+    import numpy as np
+    import pandas as pd
+    codes, uniques = pd.factorize(versions)
+    keys = [version_key(v) for v in uniques]
+    position = {k: n for n, k in enumerate(sorted(set(k for k in keys if k is not None)))}
+    ranks = np.array([-1 if k is None else position[k] for k in keys], dtype=int)
+    return ranks[codes]
+
+
+def sort_by_version(df, by=('package',), ascending=True):
+    '''
+    Sorts an inventory by the given columns and then by version order,
+    keeping the original order among equal versions. For example, the
+    latest version of each package per owner is given by
+        sort_by_version(df, ['owner', 'package']).groupby(['owner', 'package']).last()
+
+    Args:
+        df (DataFrame): an inventory.
+        by (list): the columns to sort by before the version.
+        ascending (bool): the direction of the version sort.
+    Returns:
+        DataFrame: the sorted inventory.
+    '''
+    by = list(by)
+    df = df.assign(_rank=version_ranks(df['version']))
+    df = df.sort_values(by + ['_rank'], ascending=[True] * len(by) + [ascending], kind='mergesort')
+    return df.drop(columns='_rank')
+
+
+def version_range(versions, lower=None, upper=None):
+    '''
+    Tests a column of version strings against the range lower <= v < upper,
+    comparing precomputed keys once per distinct version.
+
+    Args:
+        versions (Series): the version strings.
+        lower (str): the inclusive lower bound, if any.
+        upper (str): the exclusive upper bound, if any.
+    Returns:
+        ndarray: a boolean mask. Invalid versions are never in range.
+    '''
+    import numpy as np
+    import pandas as pd
+    lower = VersionOrder(lower).key if lower else None
+    upper = VersionOrder(upper).key if upper else None
+    codes, uniques = pd.factorize(versions)
+    keys = [version_key(v) for v in uniques]
+    matches = np.array([k is not None and (lower is None or k >= lower) and
+                        (upper is None or k < upper) for k in keys], dtype=bool)
+    return matches[codes]
+
+
 def validate_summarize(level):
     sep = '_' if '_' in level else '/'
     parts = set(level.lower().split(sep))
@@ -260,22 +368,16 @@ def validate_summarize(level):
     return ''.join(project_choices), ''.join(package_choices)
 
 
-def summarize_data(data, level):
-    project_group, package_group = validate_summarize(level)
+SUMMARY_COLUMNS = ('n_owners', 'n_projects', 'n_environments', 'n_required',
+                   'n_requested', 'n_python', 'n_r')
 
-    def _summary(data):
-        n_owners = len(data['owner'].drop_duplicates())
-        n_projects = len(data[['owner', 'project']].drop_duplicates())
-        n_envs = len(data[['owner', 'project', 'environment']].drop_duplicates())
-        n_required = sum(data.required)
-        n_requested = sum(data.requested)
-        n_python = sum(data.package == 'python')
-        n_r = sum(data.package == 'r-base')
-        return (n_owners, n_projects, n_envs, n_required, n_requested, n_python, n_r)
-    columns = ('n_owners', 'n_projects', 'n_environments', 'n_required', 'n_requested', 'n_python', 'n_r')
+
+def summary_grouping(level, nodes=False):
+    # With inventories merged from several nodes, the node and its owners,
+    # projects, and environments are distinct from those of other nodes.
+    project_group, package_group = validate_summarize(level)
 
     if project_group in ('', 'all', 'node'):
-        project_group = 'node'
         grouping = []
     elif project_group == 'owner':
         grouping = ['owner']
@@ -285,12 +387,32 @@ def summarize_data(data, level):
         grouping = ['owner', 'project', 'environment']
 
     left, right = len(grouping), 5
+    if nodes and project_group not in ('', 'all'):
+        grouping.insert(0, 'node')
     if package_group in ('', 'all'):
         right = 7
     elif package_group == 'package':
         grouping.append('package')
     else:
         grouping.extend(('package', 'version'))
+    return grouping, left, right
+
+
+def summarize_data(data, level):
+    import pandas as pd
+    nodes = 'node' in data.columns
+    grouping, left, right = summary_grouping(level, nodes)
+    owner = ['node', 'owner'] if nodes else ['owner']
+
+    def _summary(data):
+        n_owners = len(data[owner].drop_duplicates())
+        n_projects = len(data[owner + ['project']].drop_duplicates())
+        n_envs = len(data[owner + ['project', 'environment']].drop_duplicates())
+        n_required = sum(data.required)
+        n_requested = sum(data.requested)
+        n_python = sum(data.package == 'python')
+        n_r = sum(data.package == 'r-base')
+        return (n_owners, n_projects, n_envs, n_required, n_requested, n_python, n_r)
 
     records = []
     if not grouping:
@@ -301,11 +423,12 @@ def summarize_data(data, level):
             record = list(group) if isinstance(group, tuple) else [group]
             record.extend(results[left:right])
             records.append(record)
-    df = pd.DataFrame(records, columns=grouping + list(columns[left:right]))
+    df = pd.DataFrame(records, columns=grouping + list(SUMMARY_COLUMNS[left:right]))
     return df
 
 
-def build_project_inventory(owner_name, project_name=None, project_root=None, records_only=False):
+def build_project_inventory(owner_name, project_name=None, project_root=None, records_only=False,
+                            database=None):
     if '/' in owner_name:
         project_home = abspath(owner_name)
         project_name = basename(project_home)
@@ -326,65 +449,379 @@ def build_project_inventory(owner_name, project_name=None, project_root=None, re
             continue
         envdata = environment_by_prefix(prefix)
         packages = envdata.get('packages', {})
-        required = imported.copy()
-        while True:
-            n_pkgs = len(required)
-            for pkg in list(required):
-                deps = packages.get(pkg, {}).get('depends')
-                if deps:
-                    required.update(deps.intersection(packages))
-            if len(required) == n_pkgs:
-                break
-        bases = {}
-        for base in required.intersection(('r-base', 'python')):
-            imported.add(base)
-            bases[base] = all_children(packages, packages[base]['reverse'], 'reverse')
+        graph = environment_graph(envdata)
+        depends, reverse = graph['depends'], graph['reverse']
+        required = closure(depends, to_mask(graph, imported))
+        bases = to_mask(graph, ('r-base', 'python')) & required
+        imported.update(to_names(graph, bases))
+        imported = to_mask(graph, imported)
         envname = envrec['shortname']
-        extra = set(packages) - required
-        required -= imported
-        for pkg in sorted(imported):
-            if pkg in packages:
-                pdata = packages[pkg]
-                records.append((owner_name, project_name, envname, pkg, pdata['version'], pdata['build'], True, True, ''))
-        for pkg in sorted(required):
-            if pkg in packages:
-                pdata = packages[pkg]
-                # If a package depends on another package transitively through one of the base
-                # packages (python, r-base), we don't want it to show up in this list. This
-                # reduces the noise in this list considerably.
-                revs = all_children(packages, pdata['reverse'], 'reverse', bases)
-                if not revs:
-                    revs = all_children(packages, pdata['reverse'], 'reverse', imported)
-                revs = ', '.join(sorted(revs))
-                records.append((owner_name, project_name, envname, pkg, pdata['version'], pdata['build'], True, False, revs))
-        for pkg in sorted(extra):
-            if pkg in packages:
-                pdata = packages[pkg]
-                records.append((owner_name, project_name, envname, pkg, pdata['version'], pdata['build'], False, False, ''))
+        extra = ~required & ((1 << len(graph['names'])) - 1)
+        required &= ~imported
+        for pkg in to_names(graph, imported):
+            pdata = packages[pkg]
+            records.append((owner_name, project_name, envname, pkg, pdata['version'], pdata['build'], True, True, ''))
+        for pkg in to_names(graph, required):
+            pdata = packages[pkg]
+            # If a package depends on another package transitively through one of the base
+            # packages (python, r-base), we don't want it to show up in this list. This
+            # reduces the noise in this list considerably.
+            start = reverse[graph['ids'][pkg]]
+            revs = closure(reverse, start, bases) & bases
+            if not revs:
+                revs = closure(reverse, start, imported) & imported
+            revs = ', '.join(to_names(graph, revs))
+            records.append((owner_name, project_name, envname, pkg, pdata['version'], pdata['build'], True, False, revs))
+        for pkg in to_names(graph, extra):
+            pdata = packages[pkg]
+            records.append((owner_name, project_name, envname, pkg, pdata['version'], pdata['build'], False, False, ''))
+    if database is not None:
+        database.add_project(owner_name, project_name, all_envs, records)
     return records if records_only else _build_df(records)
 
 
-def build_owner_inventory(owner_name, project_root=None, records_only=False):
+def _counters():
+    return {'files_scanned': run_stats['files_scanned'],
+            'bytes_read': io_stats['bytes'],
+            'parse_time': run_times['parse'],
+            'env_load_time': run_times['environments'],
+            'errors': run_stats['errors']}
+
+
+def _project_result(project_home, database=None, checkpoint=None, dataframes=False):
+    start = time.monotonic()
+    before = _counters()
+    records = checkpoint.get(project_home) if checkpoint is not None else None
+    environments = checkpoint.get_environments(project_home) if records is not None else None
+    if records is not None and (database is None or environments is not None):
+        logger.info('Skipping completed project: {}'.format(checkpoint.key(project_home)))
+        if database is not None:
+            database.add_project(basename(dirname(project_home)), basename(project_home),
+                                 environments, records)
+        status = 'resumed'
+    elif checkpoint is not None:
+        # The environment data is captured for the journal on its way to the database
+        capture = _DeferredDatabase(database)
+        records = build_project_inventory(project_home, records_only=True, database=capture)
+        environments = capture.projects[0][2]
+        if database is not None:
+            capture.flush()
+        checkpoint.add(project_home, records, environments)
+        status = 'scanned'
+    else:
+        records = build_project_inventory(project_home, records_only=True, database=database)
+        status = 'scanned'
+    stats = {key: value - before[key] for key, value in _counters().items()}
+    stats['environments'] = len(set(record[2] for record in records))
+    return {'owner': basename(dirname(project_home)),
+            'project': basename(project_home),
+            'status': status,
+            'time': time.monotonic() - start,
+            'stats': stats,
+            'records': _build_df(records) if dataframes else records}
+
+
+def iter_owner_inventory(owner_name, project_root=None, database=None, checkpoint=None,
+                         dataframes=False):
+    '''
+    Scans the projects of an owner one at a time, yielding the results of
+    each project as soon as it is complete. Once the owner is complete, the
+    cached data for its projects is evicted.
+
+    Args:
+        owner_name (str): the name of the owner, or the path to its directory.
+        project_root (str): the root of the project store.
+        database (InventoryDatabase): receives the results of each scan.
+        checkpoint (Checkpoint): the journal of completed projects.
+        dataframes (bool): if True, the records of each project are given
+            as a DataFrame instead of a list of tuples.
+    Yields:
+        dict: the owner and project names; the status, 'scanned', or
+            'resumed' if the records came from the checkpoint; the elapsed
+            time in seconds; the work done for the project, as counts of
+            the files scanned, bytes read, and errors, the seconds spent
+            parsing files and loading environments, and the number of
+            environments inventoried; and the inventory records.
+    '''
     if '/' in owner_name:
         owner_home = owner_name
     else:
         if project_root is None:
             project_root = config.PROJECT_ROOT
         owner_home = join(abspath(project_root), owner_name)
-    records = []
     owner_home = abspath(owner_home)
     set_log_root(dirname(owner_home))
-    for projectrc in sorted(glob(join(owner_home, '*', '.projectrc'))):
-        records.extend(build_project_inventory(dirname(projectrc), records_only=True))
+    try:
+        for projectrc in sorted(glob(join(owner_home, '*', '.projectrc'))):
+            yield _project_result(dirname(projectrc), database, checkpoint, dataframes)
+    finally:
+        current_context().evict_local(owner_home)
+
+
+def build_owner_inventory(owner_name, project_root=None, records_only=False, database=None,
+                          checkpoint=None, progress=None):
+    records = []
+    for result in iter_owner_inventory(owner_name, project_root, database, checkpoint):
+        records.extend(result['records'])
+        if progress is not None:
+            progress(result)
     return records if records_only else _build_df(records)
 
 
-def build_node_inventory(project_root=None, records_only=False):
+def count_projects(project_root=None, owner_name=None):
+    '''
+    Counts the projects that build_node_inventory, or build_owner_inventory
+    if an owner is given, would scan, without reading any of them.
+    '''
+    if project_root is None:
+        project_root = config.PROJECT_ROOT
+    if owner_name is None:
+        owner_homes = glob(join(abspath(project_root), '*'))
+    elif '/' in owner_name:
+        owner_homes = [owner_name]
+    else:
+        owner_homes = [join(abspath(project_root), owner_name)]
+    return sum(len(glob(join(owner_home, '*', '.projectrc'))) for owner_home in owner_homes)
+
+
+def parse_shard(shard):
+    match = re.match(r'^(\d+)/(\d+)$', shard.strip())
+    if match:
+        index, count = map(int, match.groups())
+        if 1 <= index <= count:
+            return index, count
+    raise RuntimeError('Invalid shard: {} (expected i/N with 1 <= i <= N)'.format(shard))
+
+
+def shard_units(project_root, by='project'):
+    '''
+    Lists the units of work of a node in the sorted order build_node_inventory
+    uses, with their weights. Projects are weighted by the size of their
+    source files, and owners by their number of projects.
+
+    Returns:
+        list: a list of project directories and a weight for each unit.
+    '''
+    if by not in ('owner', 'project'):
+        raise RuntimeError('Invalid shard unit: {}'.format(by))
+    units = []
+    for owner_home in sorted(glob(join(abspath(project_root), '*'))):
+        projects = [dirname(projectrc) for projectrc in sorted(glob(join(owner_home, '*', '.projectrc')))]
+        if by == 'owner':
+            units.append((projects, len(projects)))
+        else:
+            units.extend(([project_home], project_size(project_home) + 1) for project_home in projects)
+    return units
+
+
+def shard_plan(fpath, project_root, by='project'):
+    '''
+    Returns the units of work of a node, as given by shard_units, from a plan
+    file. If the file does not exist, the units are measured and written to
+    it, unless another job creates it first, in which case that plan is
+    used. All jobs sharing a plan divide the node identically, however much
+    the files change between their runs; projects created later are in no
+    shard.
+
+    Args:
+        fpath (str): the plan file.
+        project_root (str): the root directory of the project store.
+        by (str): the unit of work, 'owner' or 'project'.
+    Returns:
+        list: a list of project directories and a weight for each unit.
+    '''
+    project_root = abspath(project_root)
+    if not exists(fpath):
+        units = shard_units(project_root, by)
+        plan = {'root': project_root, 'by': by,
+                'units': [[[basename(dirname(p)) + '/' + basename(p) for p in projects], weight]
+                          for projects, weight in units]}
+        tmp_path = '{}.{}.tmp'.format(fpath, os.getpid())
+        with open(tmp_path, 'wt') as fp:
+            json.dump(plan, fp)
+        try:
+            # Linking fails if the plan exists, so the first job to finish wins
+            os.link(tmp_path, fpath)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(fpath, 'rt') as fp:
+        plan = json.load(fp)
+    if plan['root'] != project_root or plan['by'] != by:
+        raise RuntimeError('Shard plan {} was made for {} by {}'.format(fpath, plan['root'], plan['by']))
+    return [([join(project_root, key) for key in projects], weight) for projects, weight in plan['units']]
+
+
+def select_shard(project_root, index, count, by='project', plan=None):
+    '''
+    Deterministically selects a subset of the projects on a node. The units
+    of work listed by shard_units are split into contiguous blocks of
+    roughly equal weight. Because the blocks are contiguous, concatenating
+    the output of shards 1 through N reproduces the unsharded output
+    exactly, provided that every shard sees the same weights. Since the
+    weights are measured when each shard runs, shards run at different
+    times should share a plan file; see shard_plan.
+
+    Args:
+        project_root (str): the root directory of the project store.
+        index (int): the shard to select, from 1 to count.
+        count (int): the total number of shards.
+        by (str): the unit of work, 'owner' or 'project'.
+        plan (str): the path to a shard plan file, if any.
+    Returns:
+        list: the project directories in the shard, in scan order.
+    '''
+    if plan is not None:
+        units = shard_plan(plan, project_root, by)
+    else:
+        units = shard_units(project_root, by)
+    total = sum(weight for _, weight in units)
+    result, cumulative = [], 0
+    if not total:
+        return result
+    for projects, weight in units:
+        # Assign each unit to the shard that contains the midpoint of its weight
+        if min(count - 1, ((2 * cumulative + weight) * count) // (2 * total)) == index - 1:
+            result.extend(projects)
+        cumulative += weight
+    return result
+
+
+def project_environments(project_home):
+    '''
+    Returns the environments outside of a project that its scan may read:
+    the visible shared environments, and those named by the kernels of its
+    notebooks. Projects with the same result benefit from being scanned
+    together, since the environment data they need is then still cached.
+    Only the kernelspecs of the notebooks are decoded; their imports are
+    left for the scan itself.
+    '''
+    local = join(project_home, '')
+    prefixes = set(prefix for prefix, _ in visible_project_environments(project_home)
+                   if not prefix.startswith(local))
+    for root, dirs, files in walk_project(project_home, warn=False):
+        for file in files:
+            if file.endswith('.ipynb'):
+                kernel = load_kernel_name(join(root, file))
+                prefix = kernel and kernel_name_to_prefix(project_home, kernel)
+                if prefix and not prefix.startswith(local):
+                    prefixes.add(prefix)
+    return frozenset(prefixes)
+
+
+def locality_order(projects):
+    '''
+    Orders projects so that those using the same environments, as given by
+    project_environments, are adjacent. Otherwise the original order is kept.
+
+    Args:
+        projects (list): the project directories.
+    Returns:
+        list: the indices of the projects, in the order to scan them.
+    '''
+    keys = [tuple(sorted(project_environments(project_home))) for project_home in projects]
+    return sorted(range(len(projects)), key=lambda k: (keys[k], k))
+
+
+class _DeferredDatabase(object):
+    '''
+    Holds the database writes of a project scanned out of order, so that
+    they can be applied in the original order of the projects. It also
+    captures the environment data of a scan for the checkpoint journal.
+    '''
+
+    def __init__(self, database):
+        self.database = database
+        self.projects = []
+
+    def add_project(self, *args):
+        self.projects.append(args)
+
+    def flush(self):
+        for args in self.projects:
+            self.database.add_project(*args)
+        self.projects = []
+
+
+def _scan_projects(projects, database=None, checkpoint=None, dataframes=False, schedule='alphabetical'):
+    '''
+    Scans the given projects in the order chosen by the schedule, yielding
+    the results in the original order. The cached data of an owner is
+    evicted once all of its projects are complete.
+    '''
+    if schedule not in SCHEDULES:
+        raise RuntimeError('Invalid schedule: {}'.format(schedule))
+    context = current_context()
+    remaining = {}
+    for project_home in projects:
+        owner_home = dirname(project_home)
+        remaining[owner_home] = remaining.get(owner_home, 0) + 1
+    if schedule == 'locality':
+        order = locality_order(projects)
+    else:
+        order = range(len(projects))
+    # Results that complete ahead of an earlier project wait here
+    pending = {}
+    next_index = 0
+    for index in order:
+        project_home = projects[index]
+        target = database
+        if database is not None and index != next_index:
+            target = _DeferredDatabase(database)
+        pending[index] = (_project_result(project_home, target, checkpoint, dataframes), target)
+        owner_home = dirname(project_home)
+        remaining[owner_home] -= 1
+        if not remaining[owner_home]:
+            context.evict_local(owner_home)
+        while next_index in pending:
+            result, target = pending.pop(next_index)
+            if isinstance(target, _DeferredDatabase):
+                target.flush()
+            yield result
+            next_index += 1
+
+
+def iter_node_inventory(project_root=None, database=None, checkpoint=None, shard=None,
+                        shard_by='project', dataframes=False, schedule='alphabetical', projects=None):
+    '''
+    Scans the projects of a node, or of one shard of it, one at a time.
+    The results are yielded in the order build_node_inventory reports them,
+    as described in iter_owner_inventory. A shard is given either as a
+    shard index and count, or as the project list select_shard returned.
+
+    With the 'locality' schedule, projects that use the same environments
+    are scanned consecutively, which reduces how often the environment data
+    must be rebuilt. The results are still yielded, and written to the
+    database, in the alphabetical order; a result that completes early is
+    held until the results before it have been yielded.
+    '''
     if project_root is None:
         project_root = config.PROJECT_ROOT
-    records = []
     project_root = abspath(project_root)
     set_log_root(project_root)
-    for owner_home in sorted(glob(join(project_root, '*'))):
-        records.extend(build_owner_inventory(owner_home, records_only=True))
+    if projects is not None:
+        pass
+    elif shard is not None:
+        projects = select_shard(project_root, *shard, by=shard_by)
+    elif schedule != 'alphabetical':
+        projects = [dirname(projectrc) for owner_home in sorted(glob(join(project_root, '*')))
+                    for projectrc in sorted(glob(join(owner_home, '*', '.projectrc')))]
+    else:
+        for owner_home in sorted(glob(join(project_root, '*'))):
+            yield from iter_owner_inventory(owner_home, database=database, checkpoint=checkpoint,
+                                            dataframes=dataframes)
+        return
+    yield from _scan_projects(projects, database, checkpoint, dataframes, schedule)
+
+
+def build_node_inventory(project_root=None, records_only=False, database=None, checkpoint=None,
+                         shard=None, shard_by='project', schedule='alphabetical', progress=None,
+                         projects=None):
+    records = []
+    for result in iter_node_inventory(project_root, database, checkpoint, shard, shard_by,
+                                      schedule=schedule, projects=projects):
+        records.extend(result['records'])
+        if progress is not None:
+            progress(result)
     return records if records_only else _build_df(records)
@@ -0,0 +1,110 @@
+import collections
+import os
+import shutil
+import subprocess
+import time
+
+from . import config
+
+__all__ = ['TokenBucket', 'throttle', 'lower_priority']
+
+
+class TokenBucket(object):
+    '''
+    Limits the rate at which a resource is used. Tokens accumulate at the
+    given rate, up to one second's worth, and each use takes tokens from the
+    bucket. A use that overdraws the bucket sleeps until the balance is
+    restored, so short bursts are allowed but the average rate is not
+    exceeded.
+
+    Args:
+        rate (float): the number of tokens added per second.
+        clock (function): returns the current time in seconds.
+        sleep (function): sleeps for the given number of seconds.
+    '''
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = rate
+        self.stamp = clock()
+        self.waited = 0.0
+
+    def consume(self, amount=1):
+        '''
+        Takes tokens from the bucket, sleeping if it has been overdrawn.
+
+        Returns:
+            float: the number of seconds slept.
+        '''
+        now = self.clock()
+        self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate) - amount
+        self.stamp = now
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        self.sleep(delay)
+        self.waited += delay
+        return delay
+
+
+_buckets = {}
+# The totals of everything passed to throttle, whether or not it is limited
+io_stats = collections.Counter()
+
+
+def _bucket(kind, rate):
+    bucket = _buckets.get(kind)
+    if bucket is None or bucket.rate != rate:
+        bucket = _buckets[kind] = TokenBucket(rate)
+    return bucket
+
+
+def throttle(nbytes=0, ops=1):
+    '''
+    Accounts for a file operation against config.MAX_OPS_RATE, and for the
+    bytes it read against config.MAX_READ_RATE, sleeping as needed to stay
+    within them. Every file read and directory listing of a scan passes
+    through here, so it also keeps the totals in io_stats.
+
+    Args:
+        nbytes (int): the number of bytes read.
+        ops (int): the number of file operations performed.
+    '''
+    io_stats['bytes'] += nbytes
+    io_stats['ops'] += ops
+    if config.MAX_OPS_RATE and ops:
+        _bucket('ops', config.MAX_OPS_RATE).consume(ops)
+    if config.MAX_READ_RATE and nbytes:
+        _bucket('read', config.MAX_READ_RATE).consume(nbytes)
+
+
+def throttled_time():
+    '''
+    Returns the total number of seconds slept by throttle.
+    '''
+    return sum(bucket.waited for bucket in _buckets.values())
+
+
+def lower_priority(increment=10):
+    '''
+    Lowers the CPU priority of this process, and moves it to the idle I/O
+    scheduling class, so that it only uses the disk when no other process
+    needs it. The I/O class is set with psutil if it is installed, or with
+    the ionice utility otherwise.
+
+    Returns:
+        bool: True if the I/O priority was lowered as well.
+    '''
+    os.nice(increment)
+    try:
+        import psutil
+        psutil.Process().ionice(psutil.IOPRIO_CLASS_IDLE)
+        return True
+    except Exception:
+        pass
+    if shutil.which('ionice'):
+        cmd = ['ionice', '-c', '3', '-p', str(os.getpid())]
+        return subprocess.call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+    return False
@@ -1,26 +1,57 @@
+import collections
+import contextlib
 import logging
-import functools
 import json
 import os
+import sys
+import time
 
 from textwrap import TextWrapper
 
+from .notebook import load_members, load_notebook, parse_notebook
+from .throttle import throttle
+
 
 logger = logging.getLogger(__name__.rsplit('.', 1)[0])
 
 # If we're in a Jupyter notebook, we need to play some tricks
 # in order to get the logger output to show up in the notebook.
+# IPython is only consulted if already loaded, as importing it is slow.
 try:
-    from IPython import get_ipython
-    if 'IPKernelApp' in get_ipython().config:
-        import sys
-        logger.handlers = [logging.StreamHandler(sys.stderr)]
+    if 'IPython' in sys.modules:
+        from IPython import get_ipython
+        if 'IPKernelApp' in get_ipython().config:
+            logger.handlers = [logging.StreamHandler(sys.stderr)]
 except Exception:
     pass
 
 
 LOG_ROOT = None
 
+# Counters describing the current run, reported at the end of a CLI scan
+run_stats = collections.Counter()
+# Seconds spent in each phase of the current run, accumulated by timed()
+run_times = collections.Counter()
+_active_phases = set()
+
+
+@contextlib.contextmanager
+def timed(phase):
+    '''
+    Adds the time spent in a block, or in calls to a decorated function, to
+    run_times[phase]. Nested blocks of the same phase are only counted once.
+    '''
+    if phase in _active_phases:
+        yield
+        return
+    _active_phases.add(phase)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        run_times[phase] += time.monotonic() - start
+        _active_phases.discard(phase)
+
 
 def set_log_root(fpath):
     global LOG_ROOT
@@ -44,7 +75,13 @@ def wrap(t):
     return '\n'.join(wrapper.wrap(t))
 
 
-def warn_file(fpath, msg, exc=None):
+def warn_file(fpath, msg, exc=None, error=False):
+    '''
+    Logs a warning about a file. With error=True, the warning reports a
+    failure to read or process the file, and is counted in run_stats.
+    '''
+    if error:
+        run_stats['errors'] += 1
     if exc is not None:
         msg = msg + '\n' + wrap(str(exc))
     logger.warning('{}: {}'.format(shortpath(fpath), msg))
@@ -53,24 +90,51 @@ def warn_file(fpath, msg, exc=None):
 last_path = None
 
 
-@functools.lru_cache()
-def load_file(fpath):
+def read_file(fpath, members=None, contents=None):
+    '''
+    Reads a notebook, JSON, or text file, logging an error and returning None
+    if it cannot be read or parsed. Given a list of members, only those
+    members of a JSON object are decoded; the rest is skipped. Given the
+    contents of the file, as bytes or a memory map, they are parsed instead
+    of the file being read again.
+    '''
     global last_path
     try:
-        with open(fpath, 'rb') as fp:
-            ndata = fp.read()
+        if contents is None and fpath.endswith('.ipynb'):
+            # Notebooks are parsed straight from the file, skipping cell outputs
+            throttle(os.path.getsize(fpath))
+            result = load_notebook(fpath)
+        elif contents is None and members is not None:
+            throttle(os.path.getsize(fpath))
+            result = load_members(fpath, members)
+        else:
+            if contents is None:
+                with open(fpath, 'rb') as fp:
+                    contents = fp.read()
+                throttle(len(contents))
+            if fpath.endswith('.ipynb'):
+                result = parse_notebook(contents)
+            elif fpath.endswith('.json'):
+                result = json.loads(contents)
+            else:
+                result = str(contents, "utf-8", "replace")
     except (IOError, OSError):
+        run_stats['errors'] += 1
         logger.error('{}: CANNOT READ'.format(shortpath(fpath)))
         return None
-    if fpath.endswith(('.ipynb', '.json')):
-        try:
-            result = json.loads(ndata)
-        except Exception:
-            if last_path != fpath:
-                logger.error('{}: INVALID JSON'.format(shortpath(fpath)))
-                last_path = fpath
-            return None
-    else:
-        result = ndata.decode("utf-8", "replace")
+    except Exception:
+        run_stats['errors'] += 1
+        if last_path != fpath:
+            logger.error('{}: INVALID JSON'.format(shortpath(fpath)))
+            last_path = fpath
+        return None
     logger.debug('{}: loaded'.format(shortpath(fpath)))
     return result
+
+
+def load_file(fpath):
+    '''
+    Reads a file with read_file. Kept for existing callers; the contents are
+    no longer cached, since imports.analyze_content memoizes the results.
+    '''
+    return read_file(fpath)
@@ -11,6 +11,8 @@ import re
 
 from itertools import zip_longest
 
+from .context import current_context
+
 string_types = text_type = str
 
 
@@ -22,10 +24,48 @@ class InvalidVersionSpec(ValueError):
 
 version_check_re = re.compile(r'^[\*\.\+!_0-9a-z]+$')
 version_split_re = re.compile('([0-9]+|[*]+|[^0-9*]+)')
-version_cache = {}
+
+
+def _zero_run_key(items):
+    """
+    Encodes a sequence that is implicitly padded with zeros, so that plain
+    tuple comparison of the results orders the padded sequences. Each item
+    is a (sign, value) pair, where sign is negative for items that sort
+    below zero, zero for zeros, and positive for items that sort above
+    zero. Zeros are folded into a count on the next nonzero item, and a
+    terminator stands in for the infinite run of trailing zeros.
+    """
+    result, zeros = [], 0
+    for sign, value in items:
+        if sign == 0:
+            zeros += 1
+        else:
+            # A negative item preceded by more zeros sorts higher, since
+            # the other sequence has the negative item where this has zero;
+            # the opposite holds for positive items.
+            result.append((0, zeros, value) if sign < 0 else (2, -zeros, value))
+            zeros = 0
+    result.append((1,))
+    return tuple(result)
+
+
+def _component_key(component):
+    # strings < 0 (the fill value) < positive integers < inf ('post')
+    return _zero_run_key((-1, c) if isinstance(c, string_types) else (1 if c else 0, c)
+                         for c in component)
+
+
+def _version_key(components):
+    keys = (_component_key(c) for c in components)
+    # the first entry of a component key gives its sign relative to zero
+    return _zero_run_key((k[0][0] - 1, k) for k in keys)
 
 
 class SingleStrArgCachingType(type):
+    @property
+    def _cache_(cls):
+        return current_context().cache(cls._cache_name_)
+
     def __call__(cls, arg):
         if isinstance(arg, cls):
             return arg
@@ -149,7 +189,12 @@ class VersionOrder(object, metaclass=SingleStrArgCachingType):
 
       1.0.1a  =>  1.0.1post.a      # ensure correct ordering for openssl
     """
-    _cache_ = {}
+    __slots__ = ('norm_version', 'version', 'local', 'key')
+    _cache_name_ = 'versions'
+
+    # when fillvalue ==  0  =>  1.1 == 1.1.0
+    # when fillvalue == -1  =>  1.1  < 1.1.0
+    fillvalue = 0
 
     def __init__(self, vstr):
         # version comparison is case-insensitive
@@ -166,10 +211,7 @@ class VersionOrder(object, metaclass=SingleStrArgCachingType):
         if invalid:
             raise InvalidVersionSpec(vstr, "invalid character(s)")
 
-        # when fillvalue ==  0  =>  1.1 == 1.1.0
-        # when fillvalue == -1  =>  1.1  < 1.1.0
         self.norm_version = version
-        self.fillvalue = 0
 
         # find epoch
         version = version.split('!')
@@ -188,19 +230,19 @@ class VersionOrder(object, metaclass=SingleStrArgCachingType):
         version = version[-1].split('+')
         if len(version) == 1:
             # no local version
-            self.local = []
+            local = []
         elif len(version) == 2:
             # local version given
-            self.local = version[1].replace('_', '.').split('.')
+            local = version[1].replace('_', '.').split('.')
         else:
             raise InvalidVersionSpec(vstr, "duplicated local version separator '+'")
 
         # split version
-        self.version = epoch + version[0].replace('_', '.').split('.')
+        version = epoch + version[0].replace('_', '.').split('.')
 
         # split components into runs of numerals and non-numerals,
         # convert numerals to int, handle special strings
-        for v in (self.version, self.local):
+        for v in (version, local):
             for k in range(len(v)):
                 c = version_split_re.findall(v[k])
                 if not c:
@@ -222,6 +264,12 @@ class VersionOrder(object, metaclass=SingleStrArgCachingType):
                     # strings in phase => prepend fillvalue
                     v[k] = [self.fillvalue] + c
 
+        # store the components as tuples, which are smaller than lists
+        self.version = tuple(map(tuple, version))
+        self.local = tuple(map(tuple, local))
+        # a precomputed key with the same order, for sorting and comparison
+        self.key = (_version_key(self.version), _version_key(self.local))
+
     def __str__(self):
         return self.norm_version
 
@@ -229,14 +277,14 @@ class VersionOrder(object, metaclass=SingleStrArgCachingType):
         return "%s(\"%s\")" % (self.__class__.__name__, self)
 
     def _eq(self, t1, t2):
-        for v1, v2 in zip_longest(t1, t2, fillvalue=[]):
+        for v1, v2 in zip_longest(t1, t2, fillvalue=()):
             for c1, c2 in zip_longest(v1, v2, fillvalue=self.fillvalue):
                 if c1 != c2:
                     return False
         return True
 
     def __eq__(self, other):
-        return self._eq(self.version, other.version) and self._eq(self.local, other.local)
+        return self.key == other.key
 
     def startswith(self, other):
         # Tests if the version lists match up to the last element in "other".
@@ -251,10 +299,10 @@ class VersionOrder(object, metaclass=SingleStrArgCachingType):
         nt = len(t2) - 1
         if not self._eq(t1[:nt], t2[:nt]):
             return False
-        v1 = [] if len(t1) <= nt else t1[nt]
+        v1 = () if len(t1) <= nt else t1[nt]
         v2 = t2[nt]
         nt = len(v2) - 1
-        if not self._eq([v1[:nt]], [v2[:nt]]):
+        if not self._eq((v1[:nt],), (v2[:nt],)):
             return False
         c1 = self.fillvalue if len(v1) <= nt else v1[nt]
         c2 = v2[nt]
@@ -266,22 +314,7 @@ class VersionOrder(object, metaclass=SingleStrArgCachingType):
         return not (self == other)
 
     def __lt__(self, other):
-        for t1, t2 in zip([self.version, self.local], [other.version, other.local]):
-            for v1, v2 in zip_longest(t1, t2, fillvalue=[]):
-                for c1, c2 in zip_longest(v1, v2, fillvalue=self.fillvalue):
-                    if c1 == c2:
-                        continue
-                    elif isinstance(c1, string_types):
-                        if not isinstance(c2, string_types):
-                            # str < int
-                            return True
-                    elif isinstance(c2, string_types):
-                        # not (int < str)
-                        return False
-                    # c1 and c2 have the same type
-                    return c1 < c2
-        # self == other
-        return False
+        return self.key < other.key
 
     def __gt__(self, other):
         return other < self
@@ -413,6 +446,7 @@ OPERATOR_START = frozenset(('=', '<', '>', '!', '~'))
 
 
 class BaseSpec(object):
+    __slots__ = ('spec_str', '_is_exact', 'match')
 
     def __init__(self, spec_str, matcher, is_exact):
         self.spec_str = spec_str
@@ -476,7 +510,8 @@ class BaseSpec(object):
 
 
 class VersionSpec(BaseSpec, metaclass=SingleStrArgCachingType):
-    _cache_ = {}
+    __slots__ = ('tup', 'regex', 'operator_func', 'matcher_vo')
+    _cache_name_ = 'version_specs'
 
     def __init__(self, vspec):
         vspec_str, matcher, is_exact = self.get_matcher(vspec)
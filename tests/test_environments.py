@@ -0,0 +1,199 @@
+from project_inspect import environments
+
+import json
+import os
+import random
+
+
+METADATA = '''Metadata-Version: 2.1
+Name: foo-bar
+Version: 1.0
+Requires-Dist: requests (>=2)
+Requires-Dist: pytest ; extra == "test"
+
+Requires-Dist: description
+'''
+
+RECORD = '''foo/__init__.py,sha256=abc,10
+foo/core.py,,
+foo/_speedups.so,,
+foo_bar-1.0.dist-info/RECORD,,
+'''
+
+REQUIRES = '''six
+numpy>=1.0
+
+[test]
+pytest
+'''
+
+
+def test_get_eggs(tmpdir):
+    dist_info = tmpdir.mkdir('foo_bar-1.0.dist-info')
+    dist_info.join('METADATA').write(METADATA)
+    dist_info.join('RECORD').write(RECORD)
+    dist_info.join('top_level.txt').write('foo\n')
+    egg_info = tmpdir.mkdir('src').mkdir('baz.egg-info')
+    egg_info.join('PKG-INFO').write('Metadata-Version: 1.0\nName: baz\nVersion: 0.1\n')
+    egg_info.join('requires.txt').write(REQUIRES)
+    tmpdir.join('baz.egg-link').write('src\n.\n')
+    tmpdir.join('other.txt').write('')
+    eggs = environments.get_eggs(str(tmpdir))
+    assert sorted(eggs) == ['baz.egg-link', 'foo_bar-1.0.dist-info']
+    foo = eggs['foo_bar-1.0.dist-info']
+    assert (foo['name'], foo['version'], foo['build']) == ('foo-bar', '1.0', '<pip>')
+    assert foo['depends'] == {'requests'}
+    assert foo['modules'] == {'python': {'foo', 'foo.core', 'foo._speedups'}, 'r': set()}
+    baz = eggs['baz.egg-link']
+    assert (baz['name'], baz['version'], baz['depends']) == ('baz', '0.1', {'six', 'numpy'})
+
+
+def test_get_eggs_cache(tmpdir):
+    dist_info = tmpdir.mkdir('foo-1.0.dist-info')
+    dist_info.join('METADATA').write('Name: foo\nVersion: 1.0\nRequires-Dist: six\n')
+    first = environments.get_eggs(str(tmpdir))['foo-1.0.dist-info']
+    first['depends'].add('changed')
+    first['modules']['python'].add('changed')
+    second = environments.get_eggs(str(tmpdir))['foo-1.0.dist-info']
+    assert second['depends'] == {'six'} and not second['modules']['python']
+    # A change to the directory invalidates the cached entry
+    dist_info.join('METADATA').write('Name: foo\nVersion: 1.0\nRequires-Dist: toolz\n')
+    dist_info.join('INSTALLER').write('pip\n')
+    os.utime(str(dist_info), ns=(0, 0))
+    assert environments.get_eggs(str(tmpdir))['foo-1.0.dist-info']['depends'] == {'toolz'}
+
+
+def test_conda_package_record(tmpdir, monkeypatch):
+    from project_inspect.context import InventoryContext
+    files = ['bin/python', 'lib/python3.6/site-packages/shared/__init__.py',
+             'lib/python3.6/site-packages/shared-1.0.dist-info/RECORD']
+    # Each environment writes its own record, which notes how it was linked
+    paths = []
+    for env in ('env1', 'env2', 'env3'):
+        record = {'name': 'shared', 'version': '1.0', 'build': 'py_0', 'depends': ['python >=3'],
+                  'files': files, 'link': {'source': str(tmpdir.join('pkgs', env))}}
+        if env == 'env3':
+            # The same name-version-build, rebuilt with other files
+            record['files'] = files[1:] + ['lib/python3.6/site-packages/shared/extra.py']
+        mpath = tmpdir.mkdir(env).mkdir('conda-meta').join('shared-1.0-py_0.json')
+        mpath.write(json.dumps(record))
+        paths.append(str(mpath))
+    parsed = []
+    parse_conda_modules = environments.parse_conda_modules
+    monkeypatch.setattr(environments, 'parse_conda_modules',
+                        lambda files: parsed.append(files) or parse_conda_modules(files))
+    monkeypatch.setattr(environments, 'get_python_builtins', lambda pybin: {pybin.split(os.sep)[-3]})
+    with InventoryContext() as context:
+        headers = [environments.parse_conda_meta(mpath) for mpath in paths]
+        assert headers[0]['depends'] == {'python'} and 'files' not in headers[0]
+        first, second, third = [environments.conda_package_record(pdata) for pdata in headers]
+        assert first is second and third is not first
+        assert environments.conda_package_eggs(headers[1]) == {'shared-1.0.dist-info'}
+        # Finding the egg entries does not build the module index
+        assert first['modules'] is None and not parsed
+        modules = environments.conda_package_modules(headers[1])
+        assert modules['python'] == {'shared'}
+        assert environments.conda_package_modules(headers[0]) is modules and len(parsed) == 1
+        assert environments.conda_package_modules(headers[2])['python'] == {'shared', 'shared.extra'}
+        # The builtins of each executable stay out of the shared module data
+        for env in ('env1', 'env2'):
+            imports = environments.environment_imports(str(tmpdir.join(env)))['python']
+            assert imports == {'shared': 'shared', env: 'shared'}
+        assert environments.environment_imports(str(tmpdir.join('env3')))['python'] == \
+            {'shared': 'shared', 'shared.extra': 'shared'}
+        # Evicting an environment only forgets its path, until no path is left
+        packages = context.cache('conda_packages')
+        context.evict_local(str(tmpdir.join('env1')))
+        assert first['paths'] == {paths[1]} and len(packages) == 2
+        context.evict_local(str(tmpdir.join('env3')))
+        assert len(packages) == 1
+        context.evict_local(str(tmpdir.join('env2')))
+        assert len(packages) == 0
+        assert environments.conda_package_record(headers[0]) is not first
+
+
+def test_inventory_context(tmpdir):
+    from project_inspect.context import InventoryContext, current_context
+    from project_inspect.version import VersionOrder
+    outer = current_context()
+    for name in ('a-1.0', 'b-1.0', 'c-1.0'):
+        tmpdir.mkdir(name + '.dist-info').join('METADATA').write('Version: 1.0\n')
+    with InventoryContext(eggs=2) as context:
+        assert current_context() is context
+        assert len(environments.get_eggs(str(tmpdir))) == 3
+        assert len(context.cache('eggs')) == 2
+        assert VersionOrder('7.1') is VersionOrder('7.1')
+        assert len(context.cache('versions')) == 1
+        assert context.evict_local(str(tmpdir)) == 2
+        assert len(context.cache('eggs')) == 0
+        context.clear()
+        assert len(context.cache('versions')) == 0
+    assert current_context() is outer
+
+
+def test_cache_stats():
+    from project_inspect.cache import LRUCache
+    cache = LRUCache(2)
+    for key in ('a', 'b', 'c'):
+        cache[key] = [key] * 10
+    assert cache.get('a') is None and cache['c'] == ['c'] * 10
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['entries']) == (1, 1, 1, 2)
+    assert stats['bytes'] > 2 * (10 * 8)
+    assert 'bytes' not in cache.stats(size=False)
+
+
+def test_missing_counts(monkeypatch):
+    rng = random.Random(0)
+    names = ['a', 'b', 'c', 'a.x', 'a.y', 'b.x', 'b.x.z', 'c.y', 'math', 'd.q']
+    prefixes = ['/env{}'.format(k) for k in range(4)]
+    for trial in range(50):
+        env_modules = {prefix: {m: 'pkg-' + m for m in rng.sample(names, 4)} for prefix in prefixes}
+        local_modules = set(rng.sample(names, 1))
+        local = '/project{}'.format(trial)
+        monkeypatch.setattr(environments, 'environment_imports', lambda prefix: {'python': env_modules[prefix]})
+        monkeypatch.setattr(environments, 'get_local_packages',
+                            lambda path: {'./local': {'modules': {'python': local_modules}}})
+        modules = rng.sample(names + ['e', 'e.f', 'b.w'], 5)
+        index = environments.environment_index(prefixes)
+        subset = rng.sample(prefixes, 3)
+        expected = []
+        for prefix in subset:
+            imports = dict(env_modules[prefix], **{m: './local' for m in local_modules})
+            _, missing = environments.modules_to_packages({'imports': {'python': imports}}, modules, 'python')
+            expected.append(len(missing))
+            if not missing:
+                break
+        assert environments.missing_counts(index, subset, local, modules, 'python') == expected
+    # Once an environment resolves every import, the later ones are not read
+    consulted = []
+    env_modules = {prefix: {'math': 'python', 'a': 'pkg-a'} for prefix in prefixes}
+    monkeypatch.setattr(environments, 'environment_imports',
+                        lambda prefix: consulted.append(prefix) or {'python': env_modules[prefix]})
+    del env_modules[prefixes[0]]['a']
+    index = environments.environment_index(prefixes)
+    assert environments.missing_counts(index, prefixes, local, ['a.x'], 'python') == [1, 0]
+    assert set(consulted) == set(prefixes[:2])
+
+
+def test_dependency_graph():
+    from project_inspect.graph import closure, dependency_graph, to_mask, to_names
+    rng = random.Random(1)
+    names = ['p{:02}'.format(k) for k in range(30)]
+    packages = {name: {'depends': set(rng.sample(names, 2)) | {'missing'}} for name in names}
+    graph = dependency_graph(packages)
+    edges = {'depends': {p: packages[p]['depends'] & set(names) for p in names},
+             'reverse': {p: set(q for q in names if p in packages[q]['depends']) for p in names}}
+
+    def naive(start, field, stop=()):
+        result = set(start)
+        while True:
+            grown = result.union(*(edges[field][p] for p in result if p not in stop))
+            if grown == result:
+                return result
+            result = grown
+    for trial in range(20):
+        start, stop = rng.sample(names, 3), rng.sample(names, 5)
+        for field in ('depends', 'reverse'):
+            mask = closure(graph[field], to_mask(graph, start), to_mask(graph, stop))
+            assert to_names(graph, mask) == sorted(naive(start, field, stop))
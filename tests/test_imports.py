@@ -0,0 +1,162 @@
+from project_inspect import config, imports, notebook, project
+
+from glob import glob
+from os.path import dirname, join
+
+import json
+import pytest
+import subprocess
+import sys
+
+
+SOURCE = '''
+import os, sys as system
+from collections import OrderedDict as OD, defaultdict
+from . import sibling
+from .pkg.mod import thing
+from numpy.linalg import *
+import xml.etree.ElementTree
+'''
+
+
+def test_scan_python_imports():
+    full = imports.find_python_imports(SOURCE)
+    assert imports.scan_python_imports(SOURCE) == full
+    multiline = 'from toolz import (curry,  # comment\n                   merge)\n'
+    assert imports.scan_python_imports(multiline) == {'toolz.curry', 'toolz.merge'}
+
+
+@pytest.mark.parametrize('limit', ['size', 'time'])
+def test_parse_limits(tmpdir, limit, monkeypatch):
+    fpath = str(tmpdir.join('big.py'))
+    with open(fpath, 'w') as fp:
+        fp.write(SOURCE)
+    expected = imports.find_file_imports(fpath)
+    if limit == 'size':
+        monkeypatch.setattr(config, 'MAX_PARSE_SIZE', 10)
+    else:
+        monkeypatch.setattr(config, 'MAX_PARSE_TIME', 1e-9)
+    count = imports.run_stats['files_parse_limited']
+    assert imports.find_file_imports(fpath) == expected
+    assert imports.run_stats['files_parse_limited'] == count + 1
+
+
+def test_throttle(tmpdir, monkeypatch):
+    from project_inspect import throttle
+    now, slept = [0.0], []
+
+    def sleep(delay):
+        slept.append(delay)
+        now[0] += delay
+    bucket = throttle.TokenBucket(100, clock=lambda: now[0], sleep=sleep)
+    assert bucket.consume(60) == 0 and bucket.consume(60) == pytest.approx(0.2)
+    now[0] += 0.5
+    assert bucket.consume(50) == 0 and bucket.consume(100) == pytest.approx(1.0)
+    assert bucket.waited == pytest.approx(sum(slept))
+    # Reads are accounted for against the configured limits
+    consumed = []
+    monkeypatch.setattr(throttle.TokenBucket, 'consume', lambda self, amount=1: consumed.append(amount))
+    monkeypatch.setattr(config, 'MAX_READ_RATE', 1000)
+    monkeypatch.setattr(config, 'MAX_OPS_RATE', 10)
+    fpath = tmpdir.join('script.py')
+    fpath.write(SOURCE)
+    assert imports.read_file(str(fpath)) == SOURCE
+    assert consumed == [1, len(SOURCE)]
+
+
+def test_content_dedup(tmpdir, monkeypatch):
+    from project_inspect.context import InventoryContext
+    from project_inspect.throttle import io_stats
+    big = SOURCE + '#' * imports.SCREEN_SIZE + '\n'
+    files = {'a.py': SOURCE, 'b.py': SOURCE, 'c.R': SOURCE, 'd.py': big,
+             'e.py': big, 'f.py': big[:-2] + 'x\n', 'g.py': big}
+    for name, text in files.items():
+        tmpdir.join(name).write(text)
+    parsed = []
+    find_python_imports = imports.find_python_imports
+    monkeypatch.setattr(imports, 'find_python_imports',
+                        lambda code, **kw: parsed.append(code) or find_python_imports(code, **kw))
+    with InventoryContext():
+        expected = imports.find_file_imports(str(tmpdir.join('a.py')))
+        count = imports.run_stats['parses_avoided']
+        nbytes = io_stats['bytes']
+        for name in sorted(files):
+            result = imports.find_file_imports(str(tmpdir.join(name)))
+            assert result == ((imports.find_r_imports(SOURCE), 'r') if name == 'c.R' else expected)
+    # Each distinct Python source is parsed once, whatever its size
+    assert len(parsed) == 3
+    assert imports.run_stats['parses_avoided'] == count + 4
+    # Each file is read once, except that d.py is hashed once e.py matches it
+    assert io_stats['bytes'] - nbytes == sum(map(len, files.values())) + len(big)
+
+
+def test_load_notebook():
+    root = join(dirname(dirname(__file__)), 'test_node')
+    for fpath in glob(join(root, '*', '*', '**', '*.ipynb'), recursive=True):
+        try:
+            expected = json.loads(open(fpath, 'rb').read())
+        except ValueError:
+            with pytest.raises(ValueError):
+                notebook.load_notebook(fpath)
+            continue
+        result = notebook.load_notebook(fpath)
+        assert result.get('metadata', {}).get('kernelspec') == expected.get('metadata', {}).get('kernelspec')
+        if 'cells' in expected:
+            assert result['cells'] == [{'cell_type': cell['cell_type'], 'source': cell['source']}
+                                       for cell in expected['cells']]
+        else:
+            assert 'cells' not in result
+
+
+def test_load_kernel_name(tmpdir):
+    from project_inspect.throttle import io_stats
+    metadata = {'kernelspec': {'language': 'python', 'name': 'conda-root-py'}}
+    cells = [{'cell_type': 'code', 'source': ['import os\n'], 'outputs': ['x' * 10000]}]
+    for name, members in (('first', [('metadata', metadata), ('cells', cells)]),
+                          ('last', [('cells', cells), ('metadata', metadata)])):
+        fpath = tmpdir.join(name + '.ipynb')
+        fpath.write('{' + ', '.join('"{}": {}'.format(k, json.dumps(v)) for k, v in members) + '}')
+        nbytes = io_stats['bytes']
+        assert notebook.load_kernel_name(str(fpath)) == 'conda-root-py'
+        # Only the bytes up to the end of the metadata are charged
+        charged = io_stats['bytes'] - nbytes
+        assert charged < 200 if name == 'first' else charged == fpath.size() - len('}')
+
+
+def test_analyze_notebook():
+    fpath = join(dirname(dirname(__file__)), 'test_node', 'user1', 'Portfolio', 'portfolio.ipynb')
+    info = imports.analyze_notebook(fpath)
+    assert (info.language, info.kernel) == project.find_notebook_metadata(fpath)
+    assert imports.find_file_imports(fpath, submodules=True, locals=True) == (set(info.imports), info.language)
+    assert imports.analyze_notebook(fpath) is info
+
+
+def test_find_line_imports():
+    broken = 'x = $\n' + SOURCE + 'from toolz import (curry,\n    merge)\nimport a, \\\n    b\n'
+    found = imports.find_python_imports(broken)
+    assert found.issuperset(imports.find_python_imports(SOURCE))
+    assert {'toolz.curry', 'toolz.merge', 'a', 'b'} <= found
+
+
+def test_find_r_imports():
+    code = ('library(dplyr)\n  # library(commented)\nlibrary ( "tidyr" )\nrequire(stats)\n'
+            'a <- 1; library(caret); b <- glmnet::glmnet(x, y)\nprint("x") # ggplot2::qplot\n'
+            'z <- base :: paste0("a")\r\nx <- 1abc::def\n')
+    assert imports.find_r_imports(code) == {'dplyr', 'tidyr', 'stats', 'caret', 'glmnet',
+                                            'ggplot2', 'base', 'abc'}
+    assert imports.find_r_imports(code.splitlines()) == imports.find_r_imports(code)
+
+
+HEAVY_MODULES = ('pandas', 'numpy', 'pkg_resources', 'IPython', 'lib2to3.pygram')
+
+
+@pytest.mark.parametrize('args', [['-m', 'project_inspect', '--help'],
+                                  ['-c', 'import project_inspect.project']])
+def test_lazy_imports(args):
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                            cwd=dirname(dirname(__file__)), stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    loaded = set(line.rsplit('|', 1)[-1].strip() for line in result.stderr.splitlines()
+                 if line.startswith('import time:'))
+    assert 'project_inspect.utils' in loaded
+    assert not loaded.intersection(HEAVY_MODULES)
@@ -2,6 +2,7 @@ from project_inspect import config, project
 
 import pandas as pd
 from os.path import dirname, join
+from glob import glob
 
 import sys
 import pytest
@@ -124,3 +125,213 @@ def test_summary(master_df, project_group, package_group):
         print(summary)
         print(expected)
     assert summary.equals(expected)
+
+
+def test_database(master_df, tmpdir):
+    from project_inspect.database import InventoryDatabase
+    with InventoryDatabase(str(tmpdir.join('inventory.db'))) as database:
+        project.build_node_inventory(database=database)
+        assert database.query().equals(master_df)
+        packages = ['xlrd', 'python>=3', 'r-base']
+        assert database.query(packages).equals(project.filter_data(master_df, packages).reset_index(drop=True))
+        for level in ('all/all', 'owner/package', 'environment/version'):
+            assert database.query(summarize=level).equals(project.summarize_data(master_df, level))
+
+
+def test_cli_query(master_df, tmpdir):
+    from project_inspect.database import InventoryDatabase
+    db = str(tmpdir.join('inventory.db'))
+    with InventoryDatabase(db) as database:
+        project.build_node_inventory(database=database)
+    output = str(tmpdir.join('query.csv'))
+    # Options given before the command name are kept, and the specs combined
+    cmd = ['python', '-m', 'project_inspect', '--output', output, '--package', 'xlrd',
+           'query', '--db', db, '--package', 'pytest']
+    subprocess.check_call(cmd)
+    packages = ['xlrd', 'pytest']
+    assert _read_csv(output).equals(project.filter_data(master_df, packages).reset_index(drop=True))
+
+
+@pytest.mark.parametrize('shard_by', ('project', 'owner'))
+def test_shards(master_df, shard_by):
+    for count in (1, 2, 3):
+        shards = [project.build_node_inventory(shard=(index, count), shard_by=shard_by)
+                  for index in range(1, count + 1)]
+        assert pd.concat(shards, ignore_index=True).equals(master_df)
+
+
+def test_shard_plan(master_df, tmpdir, monkeypatch):
+    plan = str(tmpdir.join('plan.json'))
+    first = project.select_shard(PROJECT_ROOT, 1, 2, plan=plan)
+    # Later jobs keep the planned division, even if the weights change
+    # Halving weights in scan order leave only the first project in shard 1
+    order = [projects[0] for projects, _ in project.shard_units(PROJECT_ROOT)]
+    monkeypatch.setattr(project, 'project_size', lambda project_home: 2 ** (len(order) - order.index(project_home)))
+    assert len(first) > 1 and project.select_shard(PROJECT_ROOT, 1, 2) == order[:1]
+    shards = [project.select_shard(PROJECT_ROOT, index, 2, plan=plan) for index in (1, 2)]
+    assert shards[0] == first
+    df = pd.concat([project.build_node_inventory(projects=projects) for projects in shards], ignore_index=True)
+    assert df.equals(master_df)
+    with pytest.raises(RuntimeError):
+        project.select_shard(PROJECT_ROOT, 1, 2, by='owner', plan=plan)
+
+
+def test_iter_node_inventory(master_df):
+    results = list(project.iter_node_inventory(dataframes=True))
+    assert [(r['owner'], r['project']) for r in results] == sorted(
+        tuple(p.split('/')[-3:-1]) for p in glob(join(PROJECT_ROOT, '*', '*', '.projectrc')))
+    assert all(r['status'] == 'scanned' and r['time'] >= 0 for r in results)
+    assert pd.concat([r['records'] for r in results], ignore_index=True).equals(master_df)
+
+
+def test_progress(master_df):
+    import io
+    from project_inspect.progress import ProgressMeter
+
+    class Terminal(io.StringIO):
+        def isatty(self):
+            return True
+    total = project.count_projects()
+    assert total == len(glob(join(PROJECT_ROOT, '*', '*', '.projectrc')))
+    assert project.count_projects(owner_name='user1') == len(glob(join(PROJECT_ROOT, 'user1', '*', '.projectrc')))
+    stream = Terminal()
+    meter = ProgressMeter(total, stream=stream, interval=0)
+    df = project.build_node_inventory(progress=meter.update)
+    meter.close()
+    assert df.equals(master_df)
+    lines = stream.getvalue().split('\r')
+    assert lines[1].startswith('1/{} projects, '.format(total)) and 'ETA' in lines[1]
+    assert lines[-1].startswith('{0}/{0} projects, '.format(total)) and lines[-1].endswith('\n')
+    # Nothing is written to a stream that is not a terminal
+    stream = io.StringIO()
+    meter = ProgressMeter(total, stream=stream)
+    for _ in range(total):
+        meter.update()
+    meter.close()
+    assert stream.getvalue() == ''
+
+
+def test_timing_log(master_df, tmpdir):
+    import json
+    fpath = str(tmpdir.join('timing.jsonl'))
+    cmd = [sys.executable, '-m', 'project_inspect', '--root', PROJECT_ROOT, '--timing-log', fpath,
+           '--output', str(tmpdir.join('inventory.csv'))]
+    subprocess.check_call(cmd, stderr=subprocess.DEVNULL)
+    with open(fpath) as fp:
+        lines = [json.loads(line) for line in fp]
+    projects = master_df.groupby(['owner', 'project']).environment.nunique()
+    assert [(r['owner'], r['project']) for r in lines] == sorted(
+        tuple(p.split('/')[-3:-1]) for p in glob(join(PROJECT_ROOT, '*', '*', '.projectrc')))
+    for r in lines:
+        assert r['status'] == 'scanned' and r['wall_time'] >= r['parse_time'] >= 0
+        assert r['environments'] == projects.get((r['owner'], r['project']), 0)
+    # Only the unreadable files count: user2/NoEnvs/cannot_read.py and user2/ProjectInspector/bad_nb.ipynb
+    errors = {(r['owner'], r['project']): r['errors'] for r in lines if r['errors']}
+    assert set(errors) <= {('user2', 'NoEnvs'), ('user2', 'ProjectInspector')}
+    assert errors[('user2', 'ProjectInspector')] == 1
+    assert sum(r['files_scanned'] for r in lines) > 0 and sum(r['bytes_read'] for r in lines) > 0
+
+
+def test_project_environments(monkeypatch):
+    projects = [dirname(p) for p in sorted(glob(join(PROJECT_ROOT, '*', '*', '.projectrc')))]
+    expected = {}
+    for project_home in projects:
+        prefixes = set(prefix for prefix, _ in project.visible_project_environments(project_home))
+        for fpath in glob(join(project_home, '**', '*.ipynb'), recursive=True):
+            _, kernel = project.find_notebook_metadata(fpath)
+            prefixes.add(kernel and project.kernel_name_to_prefix(project_home, kernel))
+        expected[project_home] = set(p for p in prefixes if p and not p.startswith(join(project_home, '')))
+    # The pre-pass reads the kernelspecs alone, without parsing any notebook
+    monkeypatch.setattr(project, 'analyze_notebook', None)
+    for project_home in projects:
+        assert project.project_environments(project_home) == expected[project_home]
+
+
+@pytest.mark.parametrize('shard', (None, (1, 2), (2, 2)))
+def test_locality_schedule(master_df, tmpdir, monkeypatch, shard):
+    from project_inspect.database import InventoryDatabase
+    expected = project.build_node_inventory(shard=shard)
+    # Scan in reverse, so that every result but the last must be held back
+    scanned = []
+    build = project.build_project_inventory
+
+    def _build(project_home, **kwargs):
+        scanned.append(project_home)
+        return build(project_home, **kwargs)
+    monkeypatch.setattr(project, 'build_project_inventory', _build)
+    monkeypatch.setattr(project, 'locality_order', lambda projects: list(reversed(range(len(projects)))))
+    with InventoryDatabase(str(tmpdir.join('inventory.db'))) as database:
+        df = project.build_node_inventory(database=database, shard=shard, schedule='locality')
+        assert df.equals(expected)
+        assert database.query().equals(expected)
+    assert scanned == sorted(scanned, reverse=True)
+
+
+def test_merge(master_df, tmpdir):
+    from project_inspect.merge import merge_inventories, summarize_records
+    sources = []
+    for node in ('node1', 'node2'):
+        fpath = str(tmpdir.join(node + '.csv'))
+        master_df.to_csv(fpath, index=None)
+        sources.append(fpath)
+    merged = pd.concat([master_df.assign(node=node) for node in ('node1', 'node2')], ignore_index=True)
+    merged = merged[['node'] + list(project.COLUMNS)]
+    assert len(list(merge_inventories(sources))) == len(merged)
+    for level in ('all/all', 'node/package', 'owner/all', 'environment/version'):
+        summary = summarize_records(merge_inventories(sources), level)
+        assert summary.equals(project.summarize_data(merged, level))
+    filtered = list(merge_inventories(sources, ['xlrd', 'python>=3']))
+    assert len(filtered) == len(project.filter_data(merged, ['xlrd', 'python>=3']))
+
+
+def test_cli_merge(master_df, tmpdir):
+    from project_inspect.merge import merge_inventories, summarize_records
+    sources = []
+    for node in ('node1', 'node2'):
+        fpath = str(tmpdir.join(node + '.csv'))
+        master_df.to_csv(fpath, index=None)
+        sources.append(fpath)
+    output = str(tmpdir.join('merged.csv'))
+    # Options given before the command name apply to the merge
+    cmd = ['python', '-m', 'project_inspect', '--output', output, '--summarize', 'node/package',
+           '--package', 'xlrd', 'merge'] + sources
+    subprocess.check_call(cmd)
+    summary = summarize_records(merge_inventories(sources, ['xlrd']), 'node/package')
+    with open(output, 'rt') as fp:
+        assert fp.read() == summary.to_csv(index=None)
+
+
+def test_checkpoint(master_df, tmpdir):
+    from project_inspect.checkpoint import Checkpoint
+    ckdir = str(tmpdir.join('checkpoint'))
+    with Checkpoint(ckdir, PROJECT_ROOT) as checkpoint:
+        assert project.build_node_inventory(checkpoint=checkpoint).equals(master_df)
+    # Simulate an interruption in the middle of the second project
+    journal = tmpdir.join('checkpoint', 'journal.jsonl')
+    lines = journal.read().splitlines(True)
+    journal.write(''.join(lines[:4]) + lines[4][:20])
+    with Checkpoint(ckdir, PROJECT_ROOT) as checkpoint:
+        assert len(checkpoint.completed) == 1
+        assert project.build_node_inventory(checkpoint=checkpoint).equals(master_df)
+    with Checkpoint(ckdir, PROJECT_ROOT) as checkpoint:
+        assert len(checkpoint.completed) == len(glob(join(PROJECT_ROOT, '*', '*', '.projectrc')))
+
+
+def test_checkpoint_database(master_df, tmpdir):
+    from project_inspect.checkpoint import Checkpoint
+    from project_inspect.database import InventoryDatabase
+
+    def dump(path):
+        with InventoryDatabase(path) as database:
+            return list(database.conn.iterdump())
+    with InventoryDatabase(str(tmpdir.join('full.db'))) as database:
+        project.build_node_inventory(database=database)
+    # Interrupt a scan after its first project, then resume into a new database
+    ckdir = str(tmpdir.join('checkpoint'))
+    with Checkpoint(ckdir, PROJECT_ROOT) as checkpoint:
+        next(project.iter_node_inventory(checkpoint=checkpoint))
+    with Checkpoint(ckdir, PROJECT_ROOT) as checkpoint, \
+            InventoryDatabase(str(tmpdir.join('resumed.db'))) as database:
+        results = list(project.iter_node_inventory(database=database, checkpoint=checkpoint))
+    assert results[0]['status'] == 'resumed'
+    assert dump(str(tmpdir.join('resumed.db'))) == dump(str(tmpdir.join('full.db')))
@@ -0,0 +1,58 @@
+from project_inspect.version import VersionOrder, VersionSpec
+
+import pytest
+
+
+ORDERED = ['0.4', '0.4.0', '0.4.1.rc', '0.4.1.RC', '0.4.1', '0.5a1', '0.5b3', '0.5C1', '0.5',
+           '0.9.6', '0.960923', '1.0', '1.1dev1', '1.1a1', '1.1.0dev1', '1.1.dev1', '1.1.a1',
+           '1.1.0rc1', '1.1.0', '1.1', '1.1.0post1', '1.1.post1', '1.1post1', '1996.07.12',
+           '1!0.4.1', '1!3.1.1.6', '2!0.4.1']
+EQUAL = {('0.4', '0.4.0'), ('0.4.1.rc', '0.4.1.RC'), ('1.1.0dev1', '1.1.dev1'),
+         ('1.1.0', '1.1'), ('1.1.0post1', '1.1.post1')}
+
+
+def test_version_order():
+    versions = [VersionOrder(v) for v in ORDERED]
+    for (s1, v1), (s2, v2) in zip(zip(ORDERED, versions), zip(ORDERED[1:], versions[1:])):
+        if (s1, s2) in EQUAL:
+            assert v1 == v2 and not v1 < v2
+        else:
+            assert v1 < v2 and v2 > v1 and v1 != v2
+    assert VersionOrder('1.2.3').startswith(VersionOrder('1.2'))
+    assert VersionOrder('1.2+local.1').startswith(VersionOrder('1.2+local'))
+    assert not hasattr(VersionOrder('1.0'), '__dict__')
+
+
+def test_version_cache():
+    assert VersionOrder('2.0.1') is VersionOrder('2.0.1')
+    assert VersionSpec('>=2.0') is VersionSpec('>=2.0')
+    for k in range(VersionOrder._cache_.maxsize + 10):
+        VersionOrder('5.{}'.format(k))
+    assert len(VersionOrder._cache_) == VersionOrder._cache_.maxsize
+
+
+@pytest.mark.parametrize('spec,version,result', [
+    ('>=1.1', '1.1.0', True), ('1.1.*', '1.10', False), ('~=1.1.0', '1.1.5', True),
+    ('>1.0,<1.2|2.*', '2.5', True), ('!=1.1', '1.1.0', False), ('^1\\..*$', '1.5', True)])
+def test_version_spec(spec, version, result):
+    assert VersionSpec(spec).match(version) == result
+
+
+def test_version_key():
+    keys = [VersionOrder(v).key for v in ORDERED]
+    assert sorted(keys) == keys
+    for (s1, k1), (s2, k2) in zip(zip(ORDERED, keys), zip(ORDERED[1:], keys[1:])):
+        assert (k1 == k2) == ((s1, s2) in EQUAL)
+
+
+def test_version_columns():
+    import pandas as pd
+    from project_inspect import project
+    df = pd.DataFrame({'package': ['b', 'a', 'a', 'a', 'a', 'b'],
+                       'version': ['1.0', '1.10', '1.9', '<local>', '1.9.0', '0.1']})
+    assert list(project.version_ranks(df['version'])) == [1, 3, 2, -1, 2, 0]
+    result = project.sort_by_version(df)
+    assert list(result['version']) == ['<local>', '1.9', '1.9.0', '1.10', '0.1', '1.0']
+    mask = project.version_range(df['version'], '1.0', '1.10')
+    assert list(mask) == [True, False, True, False, True, False]
+    assert list(project.filter_data(df, ['b>=0.5,<2'])['version']) == ['1.0']